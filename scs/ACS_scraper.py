@@ -1,15 +1,178 @@
 """
 This code scrapes the ACS census data from its API and saves it into a file in
 the 'data' folder.
+The ACSClient caches every API response in a SQLite file, keyed by the API
+endpoint and the year, dataset, variables and geography of the request, so
+that re-runs do not call the API again, and responses of a local stand-in of
+the API are never returned for the real one. Requests with many variables are split into chunks the API
+accepts, the chunks of several years are requested at once, and the results
+are merged into one typed DataFrame.
+To run against a local stand-in of the API, with a cache of its own:
+$ python ACS_scraper.py --base-url http://127.0.0.1:8000 --cache /tmp/acs_cache.sqlite
 """
 
+import argparse
 import pandas as pd
 import requests
 import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 
-def ACS_data_fetch(state_codes):
+ACS_KEY = "2553c9516571a4f907de1e2a681c76bc8ff025fe"
+# the API accepts at most 50 variables per request, NAME included
+MAX_VARIABLES = 49
+# ACS estimates below this value are annotations, e.g. -666666666 when the
+# sample is too small
+MISSING_BELOW = -100000000
+
+
+class ACSClient:
+    """
+    Cached, batched client of the Census ACS API
+    """
+    def __init__(self, base_url="https://api.census.gov/data", key=ACS_KEY,
+                 cache_path='../data/acs_cache.sqlite', threads=4, timeout=60):
+        """
+        Inputs:
+            base_url (str): root of the API, e.g. "http://127.0.0.1:8000" for
+                            a local stand-in of the Census endpoint
+            key (str): the API key, None to send no key
+            cache_path (str): path of the SQLite response cache, None to not
+                              cache the responses
+            threads (int): number of requests sent at once
+            timeout (float): seconds before a request is abandoned
+        """
+        self.base_url = base_url.rstrip('/')
+        self.key = key
+        self.threads = threads
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.lock = threading.Lock()
+        self.conn = None
+        if cache_path is not None:
+            self.conn = sqlite3.connect(cache_path, timeout=60,
+                                        check_same_thread=False)
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                    request TEXT PRIMARY KEY,
+                                    response TEXT NOT NULL)""")
+            self.conn.commit()
+
+    def cache_get(self, request):
+        if self.conn is None:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response FROM responses WHERE request = ?",
+                (request,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def cache_put(self, request, response):
+        if self.conn is None:
+            return
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?)",
+                              (request, json.dumps(response)))
+            self.conn.commit()
+
+    def request(self, year, dataset, variables, geography, within=None):
+        """
+        Return the rows of one API request, from the cache if possible
+
+        Inputs:
+            year (int): the ACS year
+            dataset (str): the dataset path, e.g. "acs/acs1/profile"
+            variables (list): at most MAX_VARIABLES variable names
+            geography (str): the "for" clause, e.g. "state:*", "county:*"
+            within (str): the "in" clause, e.g. "state:06", or None
+        Output:
+            response (list): the header row followed by the data rows
+        """
+        key = json.dumps([self.base_url, year, dataset, sorted(variables),
+                          geography, within])
+        response = self.cache_get(key)
+        if response is not None:
+            return response
+        params = {'get': ','.join(['NAME'] + list(variables)),
+                  'for': geography}
+        if within is not None:
+            params['in'] = within
+        if self.key is not None:
+            params['key'] = self.key
+        url = "{}/{}/{}".format(self.base_url, year, dataset)
+        reply = self.session.get(url, params=params, timeout=self.timeout)
+        if reply.status_code != 200:
+            raise ValueError("ACS request for {} {} failed ({}): {}".format(
+                year, dataset, reply.status_code, reply.text[:200]))
+        response = reply.json()
+        self.cache_put(key, response)
+        return response
+
+    def fetch(self, years, dataset, variables, geography='state:*',
+              within=None):
+        """
+        Fetch variables for several years of a dataset into one DataFrame
+
+        Inputs:
+            years (list): the ACS years, e.g. [2019, 2021]
+            dataset (str): the dataset path, e.g. "acs/acs1/profile"
+            variables (list): the variable names, any number of them
+            geography (str): the "for" clause, e.g. "state:*", "county:*"
+            within (str): the "in" clause, e.g. "state:06", or None
+        Output:
+            df (DataFrame): a row per year and geography with the columns
+                            year, NAME, the variables (numeric, annotations
+                            missing) and the geography codes (strings)
+        """
+        variables = list(dict.fromkeys(variables))
+        chunks = [variables[i:i + MAX_VARIABLES]
+                  for i in range(0, len(variables), MAX_VARIABLES)]
+        jobs = [(year, chunk) for year in years for chunk in chunks]
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            responses = list(executor.map(
+                lambda job: self.request(job[0], dataset, job[1], geography,
+                                         within), jobs))
+
+        frames = []
+        for year in years:
+            df = None
+            for (job_year, chunk), response in zip(jobs, responses):
+                if job_year != year:
+                    continue
+                part = pd.DataFrame(response[1:], columns=response[0])
+                if df is None:
+                    df = part
+                else:
+                    # the chunks share NAME and the geography code columns
+                    keys = [c for c in part.columns if c not in chunk]
+                    df = df.merge(part, on=keys)
+            df.insert(0, 'year', year)
+            frames.append(df)
+        df = pd.concat(frames, ignore_index=True)
+
+        for variable in variables:
+            values = pd.to_numeric(df[variable], errors='coerce')
+            values = values.mask(values < MISSING_BELOW)
+            # counts and dollar amounts stay integers, with missing values
+            if (values.dropna() % 1 == 0).all():
+                values = values.astype('Int64')
+            df[variable] = values
+        return df
+
+    def close(self):
+        self.session.close()
+        if self.conn is not None:
+            self.conn.close()
+
+
+def ACS_data_fetch(state_codes, base_url="https://api.census.gov/data",
+                   cache_path='../data/acs_cache.sqlite',
+                   output_fileName='../data/ACS_data.csv'):
     """
+    Fetch the state level ACS variables below and save them to
+    output_fileName. base_url and cache_path are passed to ACSClient.
+
     DP02_0018E: Population in households
     Estimate!!RELATIONSHIP!!Population in households
 
@@ -29,16 +192,18 @@ def ACS_data_fetch(state_codes):
     Estimate!!GROSS RENT!!Occupied units paying rent!!Median (dollars)
     """
 
-    ACS_key = "2553c9516571a4f907de1e2a681c76bc8ff025fe"
     req_fields = ["DP02_0018E", "DP02_0068PE", "DP03_0039PE", "DP03_0062E",
                   "DP04_0101E", "DP04_0134E"]
-    req_url = f"https://api.census.gov/data/2021/acs/acs1/profile?get=NAME,{','.join(req_fields)}&for=state:*&key={ACS_key}"
-    response = requests.get(req_url).json()
+    client = ACSClient(base_url, cache_path=cache_path)
+    try:
+        df = client.fetch([2021], "acs/acs1/profile", req_fields)
+    finally:
+        client.close()
+    df = df.drop(columns='year')
 
     state_codes_df = pd.DataFrame(state_codes)
     state_codes_df.columns = ['state','abbrev']
 
-    df = pd.DataFrame(response[1:],columns=response[0])
     df = df.merge(state_codes_df, on='state')
     df.columns = ['state_name',
                 'state_pop_in_hh',
@@ -49,10 +214,18 @@ def ACS_data_fetch(state_codes):
                 'state_med_rent',
                 'state_code',
                 'state']
-    df.to_csv('../data/ACS_data.csv', index=False)
+    df.to_csv(output_fileName, index=False)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default="https://api.census.gov/data",
+                        help='root of the API, e.g. a local stand-in')
+    parser.add_argument('--cache', default='../data/acs_cache.sqlite',
+                        help='path of the response cache, "none" to not '
+                             'cache the responses')
+    parser.add_argument('--output', default='../data/ACS_data.csv')
+    args = parser.parse_args()
     state_codes = [["01", "AL"], ["02", "AK"], ["04", "AZ"], ["05", "AR"], 
                 ["06", "CA"], ["08", "CO"], ["09", "CT"], ["10", "DE"], 
                 ["11", "DC"], ["12", "FL"], ["13", "GA"], ["15", "HI"], 
@@ -66,4 +239,5 @@ if __name__ == "__main__":
                 ["45", "SC"], ["46", "SD"], ["47", "TN"], ["48", "TX"], 
                 ["49", "UT"], ["50", "VT"], ["51", "VA"], ["53", "WA"], 
                 ["54", "WV"], ["55", "WI"], ["56", "WY"], ["72", "PR"]]
-    ACS_data_fetch(state_codes)
+    ACS_data_fetch(state_codes, args.base_url,
+                   None if args.cache == 'none' else args.cache, args.output)
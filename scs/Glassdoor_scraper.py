@@ -6,18 +6,36 @@ scrape the url of the job listings under the state-level search.
 Finally, the code navigates to the job listings url and scrapes the necessary
 """
 
-import csv
+import glob
 import os
-from time import sleep
-import random
+import re
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from urllib.parse import urlparse, urlunparse
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 from bs4 import BeautifulSoup as soup
 import description_scrape
+import fetch_backend
+import html_archive
+import company_store
+import listing_cache
+import output_sink
+import scrape_pipeline
+import rate_limiter
+import scrape_journal
 import json
 
 
+CSV_HEADER = [("companyName", "company_starRating", "company_offeredRole",
+               "company_roleLocation", "company_salary", "companyHQ",
+               "company_founded", "company_industry", "company_revenue",
+               "company_size", "company_type", "company_sector",
+               "requested_url", "search_state")]
+
+
 def fileWriter(listOfTuples, output_fileName):
     """
     writes the output into a csv file at the designated folder
@@ -26,18 +44,117 @@ def fileWriter(listOfTuples, output_fileName):
         listOfTuples (list): the data that is to be saved
         output_fileName (string): path and filename where the data is saved
     """
-    with open(output_fileName,'a', newline='') as out:
-        csv_out = csv.writer(out)
-        for row_tuple in listOfTuples:
-            try:
-                csv_out.writerow(row_tuple)
-                # can also do csv_out.writerows(data) instead of the for loop
-            except Exception as e:
-                print("[WARN] In filewriter: {}".format(e))
+    with output_sink.CsvSink(output_fileName) as sink:
+        sink.write(listOfTuples)
+
+
+def page_url(base_url, page_index):
+    """
+    Build the url of a result page of a state-level search. Glassdoor
+    addresses the pages of a search by adding "_IP<page>" to the search path,
+    e.g. ".../alaska-data-science-jobs-SRCH_IL.0,6_IS496_KO7,19_IP3.htm"
+
+    Inputs:
+        base_url (str): the state-level search url (first result page)
+        page_index (int): the result page to address
+    Output:
+        url (str): the url of the result page
+    """
+    parsed = urlparse(base_url)
+    path = re.sub(r'_IP\d+(?=\.htm$)', '', parsed.path)
+    if page_index > 1:
+        path = re.sub(r'\.htm$', '_IP{}.htm'.format(page_index), path)
+    return urlunparse(parsed._replace(path=path))
+
+
+def selected_page(page_soup):
+    """
+    Return the number on the selected pagination button of a result page,
+    or None if the page has no pagination
+    """
+    button = page_soup.find("button",
+                            {"class": "page selected css-1hq9k8 e13qs2071"})
+    if button is None:
+        return None
+    return button.getText()
+
+
+def load_page_direct(driver, base_url, page_index):
+    """
+    Navigate straight to the result page with its page url. Returns the
+    parsed page, or None if Glassdoor did not serve the requested page.
+    """
+    rate_limiter.polite_get(
+        driver, page_url(base_url, page_index),
+        ready=(By.CSS_SELECTOR, "a[href*='/partner/jobListing.htm']"))
+    page_soup = soup(driver.page_source, 'lxml')
+    if selected_page(page_soup) != str(page_index):
+        return None
+    return page_soup
+
+
+def click_page(driver, page_index):
+    """
+    Click on a pagination button and wait until that page is selected
+    """
+    rate_limiter.limiter.acquire()
+    driver.find_element(By.XPATH, 
+                        "//*[@id='MainCol']/div[2]/div/div[1]//*[text()={}]"
+                        .format(page_index)).click()
+    rate_limiter.wait_for(
+        driver, (By.XPATH, "//button[contains(@class, 'selected') and text()={}]"
+                 .format(page_index)))
+
+
+def load_page_clickchain(driver, base_url, page_index):
+    """
+    Navigate to the result page by loading the first page and clicking
+    through the pagination buttons, which only show a few pages ahead
+    """
+    rate_limiter.polite_get(driver, base_url, ready=(By.ID, "MainCol"))
+
+    starting_page = 5
+    while page_index > starting_page:
+        click_page(driver, starting_page)
+        starting_page += 2
+
+    click_page(driver, page_index)
+    page_soup = soup(driver.page_source, 'lxml')
+    assert selected_page(page_soup) == str(page_index)
+    return page_soup
+
+
+def load_page(driver, base_url, page_index, use_direct=True):
+    """
+    Navigate to a result page of a state-level search, directly by its url if
+    possible and through the click chain otherwise
+
+    Inputs:
+        driver (webdriver object): the Chrome webdriver object
+        base_url (str): the state-level search url
+        page_index (int): the result page to load
+        use_direct (bool): whether to try the page url first
+    Output:
+        page_soup (BeautifulSoup object): the parsed result page
+        use_direct (bool): whether the page url worked, so that the next
+                           pages of the state skip it if it did not
+    """
+    if use_direct:
+        try:
+            page_soup = load_page_direct(driver, base_url, page_index)
+            if page_soup is not None:
+                return page_soup, True
+        except Exception as e:
+            print(e)
+        print("[NOTE] Direct page url failed, clicking through to page {}"
+              .format(page_index))
+    return load_page_clickchain(driver, base_url, page_index), False
 
 
 # main scraping function
-def glassdoor_scraper(driver, base_url, target_num, state_search, output_fileName):
+def glassdoor_scraper(driver, base_url, target_num, state_search, output_fileName,
+                      cache=None, journal=None, fetcher=None, pipeline=None,
+                      archive=None, sink=None, companies=None):
     """
     Inputs:
         driver (webdriver object): the Chrome webdriver object
@@ -45,37 +162,33 @@ def glassdoor_scraper(driver, base_url, target_num, state_search, output_fileNam
         target_num (int): the maximum number of jobs in the state-level search
         state_search (str): the name of the state it is scraping
         output_fileName (str): the path to save the output
+        cache (ListingCache): cache of already extracted listings, or None
+        journal (ScrapeJournal): progress journal to resume from and record
+                                 to, or None
+        fetcher (HttpFetcher): lightweight fetch backend for the listings,
+                               None to always use the webdriver
+        pipeline (ListingPipeline): fetch/parse pipeline for the listings,
+                                    None to fetch and parse them one by one
+        archive (HtmlArchive): archive of the raw listing pages, or None
+        sink (Sink): batched output sink of the rows (see output_sink.py),
+                     None to write every page to output_fileName right away
+        companies (CompanyStore): store of the company fields of known
+                                  employers (see company_store.py), or None
     """
     # initialise variables
     page_index = 1
     total_listingCount = 0
+    if journal is not None:
+        page_index, total_listingCount = journal.progress(state_search)
+    use_direct = True
+    # the webdriver fetch backend of the listings
+    browser = fetch_backend.SeleniumFetcher(driver, companies)
 
     while total_listingCount <= int(target_num):
         # clean up buffer
         list_returnedTuple = []
-        driver.get(base_url)
-        sleep(random.uniform(10.11, 14.86))
-                
-        starting_page = 5
-        while page_index > starting_page:
-            driver.find_element(
-                By.XPATH, 
-                "//*[@id='MainCol']/div[2]/div/div[1]//*[text()={}]"
-                .format(starting_page)).click()
-            sleep(random.uniform(3, 4))
-            starting_page += 2
-            
-        driver.find_element(By.XPATH, 
-                            "//*[@id='MainCol']/div[2]/div/div[1]//*[text()={}]"
-                            .format(page_index)).click()
-        sleep(random.uniform(3, 4))
-        src = driver.page_source
-        page_soup = soup(src, 'lxml')
-        current_page = page_soup.find(
-            "button", 
-            {"class": "page selected css-1hq9k8 e13qs2071"}
-            ).getText()
-        assert current_page == str(page_index)
+        page_soup, use_direct = load_page(driver, base_url, page_index,
+                                          use_direct)
         listings_set, jobCount = description_scrape.extract_listings_url(page_soup)
         
         print("\n[INFO] Processing page index {}: {}"
@@ -83,28 +196,378 @@ def glassdoor_scraper(driver, base_url, target_num, state_search, output_fileNam
         print("[INFO] Found {} links in page index {}"
               .format(jobCount, page_index))
 
+        listing_urls = []
+        listing_ids = []
         for listing_url in listings_set:
-            # to implement cache here
-            returned_tuple = description_scrape.extract_listing(driver, listing_url)
+            listing_id = description_scrape.extract_listing_id(listing_url)
+            # skip listings written before the last run was interrupted
+            if journal is not None and \
+                    journal.is_written(state_search, listing_id):
+                continue
+            listing_urls.append(listing_url)
+            listing_ids.append(listing_id)
+
+        for returned_tuple in listing_cache.cached_extract_listings(
+                browser, listing_urls, cache, fetcher, pipeline, archive,
+                companies):
             returned_tuple = (*returned_tuple, state_search)
             list_returnedTuple.append(returned_tuple)
 
-        fileWriter(listOfTuples=list_returnedTuple, 
-                   output_fileName=output_fileName)
+        if archive is not None:
+            for listing_url in listing_urls:
+                archive.tag(listing_url, state_search)
 
         # done with page, moving onto next page
         total_listingCount = total_listingCount + jobCount
+        # the journal records the page only once its rows are committed
+        record_page = None
+        if journal is not None:
+            record_page = partial(journal.record_page, state_search, page_index,
+                                  total_listingCount, listing_ids)
+        if sink is not None:
+            sink.write(list_returnedTuple, on_commit=record_page)
+        else:
+            fileWriter(listOfTuples=list_returnedTuple, 
+                       output_fileName=output_fileName)
+            if record_page is not None:
+                record_page()
         print("[INFO] Finished processing page index {}; \
               Total number of jobs processed: {}"
               .format(page_index, total_listingCount))
         page_index = page_index + 1
 
+    if journal is not None:
+        if sink is not None:
+            sink.write([], on_commit=partial(journal.record_state_done,
+                                             state_search))
+        else:
+            journal.record_state_done(state_search)
+
+
+def make_driver():
+    """
+    Start a headless Chrome webdriver session
+
+    Output:
+        driver (webdriver object): the Chrome webdriver object
+    """
+    # webdriver option to not open chrome UI when scraping
+    options = Options()
+    options.headless = True
+    driver = webdriver.Chrome(options=options)
+    # if Chrome webdriver is not in yout PATH
+    # driver = webdriver.Chrome(executable_path="/path/to/chrome/webdriver", options=options)
+    return driver
+
+
+def scrape_states(states, output_fileName, cache_options=None,
+                  journal_fileName=None, rate=None, fetch='http',
+                  parse_processes=0, archive_dir=None, parquet_dir=None,
+                  company_options=None):
+    """
+    Scrape a list of states with a single webdriver session. A failing state
+    is reported and skipped so the remaining states still get scraped.
+
+    Inputs:
+        states (list): list of (state index, state, state url, job count)
+        output_fileName (str): the path to save the output
+        cache_options (dict): keyword arguments of ListingCache, None to
+                              scrape without the listing cache
+        journal_fileName (str): path of the progress journal, None to scrape
+                                without recording progress
+        rate (float): requests per second for this session, None to keep the
+                      default politeness budget
+        fetch (str): "http" to request listings over HTTP first, "selenium"
+                     to always navigate the webdriver
+        parse_processes (int): number of processes parsing the listings
+                               fetched over HTTP, 0 to parse them on the
+                               scraping thread
+        archive_dir (str): folder of the raw html archive, None to not keep
+                           the fetched pages
+        parquet_dir (str): folder of the typed parquet output, None to write
+                           the rows to the csv file output_fileName
+        company_options (dict): keyword arguments of CompanyStore, None to
+                                open the Company tab of every listing
+    Output:
+        failed (list): the states that raised an error while scraping
+    """
+    failed = []
+    if rate is not None:
+        rate_limiter.configure(rate=rate)
+    cache = None
+    if cache_options is not None:
+        cache = listing_cache.ListingCache(**cache_options)
+    companies = None
+    if company_options is not None:
+        companies = company_store.CompanyStore(**company_options)
+    journal = None
+    if journal_fileName is not None:
+        journal = scrape_journal.ScrapeJournal(journal_fileName)
+        states = [state for state in states if state[1] not in journal.done]
+    if parquet_dir is not None:
+        sink = output_sink.ParquetSink(parquet_dir, CSV_HEADER[0])
+    else:
+        sink = output_sink.CsvSink(output_fileName)
+    archive = None
+    if archive_dir is not None:
+        archive = html_archive.HtmlArchive(archive_dir)
+    fetcher = None
+    pipeline = None
+    if fetch == 'http':
+        fetcher = fetch_backend.HttpFetcher()
+        if parse_processes > 0:
+            pipeline = scrape_pipeline.ListingPipeline(fetcher,
+                                                       parse_processes,
+                                                       archive=archive,
+                                                       companies=companies)
+    driver = make_driver()
+    try:
+        for i, st, url, target_num in states:
+            print("Scraping state No. {}: {}".format(i, st))
+            try:
+                glassdoor_scraper(driver, url, target_num, st, output_fileName,
+                                  cache, journal, fetcher, pipeline, archive,
+                                  sink, companies)
+            except Exception as e:
+                print(e)
+                print("[NOTE] Moving on to next state: ")
+                failed.append(st)
+    finally:
+        driver.quit()
+        sink.close()
+        if pipeline is not None:
+            pipeline.close()
+        if fetcher is not None:
+            fetcher.close()
+        if archive is not None:
+            archive.close()
+        print(rate_limiter.limiter.report())
+        if cache is not None:
+            print("[INFO] Listing cache: {} hits, {} misses"
+                  .format(cache.hits, cache.misses))
+            cache.close()
+        if companies is not None:
+            print(companies.stats())
+            companies.close()
+        if journal is not None:
+            journal.close()
+    return failed
+
+
+def shard_states(state_url, job_count_dict, n_workers, skip=()):
+    """
+    Split the states into n_workers shards with roughly the same number of
+    jobs. States are handed out from the largest to the smallest, each to the
+    shard with the fewest jobs so far.
+
+    Inputs:
+        state_url (list): the list of state-level search urls
+        job_count_dict (dict): the dictionary of "state: possible job number"
+        n_workers (int): the number of shards
+        skip (set): states to leave out, e.g. already finished ones
+    Output:
+        shards (list): list of lists of (state index, state, url, job count)
+    """
+    states = [(i, st, state_url[i], job_count_dict[st])
+              for i, st in enumerate(job_count_dict) if st not in skip]
+    shards = [[] for _ in range(n_workers)]
+    load = [0] * n_workers
+    for state in sorted(states, key=lambda x: int(x[3]), reverse=True):
+        k = load.index(min(load))
+        shards[k].append(state)
+        load[k] += int(state[3])
+    # keep the original state order inside each shard
+    return [sorted(shard) for shard in shards if shard]
+
+
+def worker_fileName(output_fileName, worker_id):
+    """
+    The path of the partial output written by a single worker
+    """
+    root, ext = os.path.splitext(output_fileName)
+    return "{}_worker{}{}".format(root, worker_id, ext)
+
+
+def merge_worker_files(worker_files, output_fileName):
+    """
+    Append the rows of the per-worker output files to the main output file
+    and remove the per-worker files
+
+    Inputs:
+        worker_files (list): paths of the per-worker output files
+        output_fileName (str): the path of the merged output
+    """
+    main = output_sink.CsvSink(output_fileName)
+    for path in worker_files:
+        if not os.path.exists(path):
+            continue
+        # only the committed rows of the worker are merged, a torn batch of a
+        # crashed worker is scraped again on resume
+        worker = output_sink.CsvSink(path)
+        main.write_bytes(worker.read_committed())
+        worker.remove()
+
+
+def scrape_pool(state_url, job_count_dict, output_fileName, n_workers,
+                cache_options=None, journal_fileName=None, rate=None,
+                fetch='http', parse_processes=0, archive_dir=None,
+                parquet_dir=None, company_options=None):
+    """
+    Scrape the states with n_workers independent webdriver sessions, each in
+    its own process. Every worker writes to its own file, which are merged
+    into output_fileName once all workers are done. A crashed worker only
+    loses its own shard.
+
+    Inputs:
+        state_url (list): the list of state-level search urls
+        job_count_dict (dict): the dictionary of "state: possible job number"
+        output_fileName (str): the path to save the output
+        n_workers (int): the number of parallel webdriver sessions
+        cache_options (dict): keyword arguments of ListingCache, shared by
+                              all workers, None to scrape without the cache
+        journal_fileName (str): path of the progress journal shared by all
+                                workers, None to scrape without recording
+                                progress
+        rate (float): total requests per second, split evenly between the
+                      workers, None for the default budget of each session
+        fetch (str): fetch backend of the listings, see scrape_states
+        parse_processes (int): parsing processes of every worker, see
+                               scrape_states
+        archive_dir (str): folder of the raw html archive, every worker
+                           writes its own segment
+        parquet_dir (str): folder of the typed parquet output shared by the
+                           workers, None to write csv files
+        company_options (dict): keyword arguments of CompanyStore, shared by
+                                all workers, None to not use the store
+    Output:
+        failed (list): the states that could not be scraped
+    """
+    done = set()
+    if journal_fileName is not None:
+        journal = scrape_journal.ScrapeJournal(journal_fileName)
+        done = journal.done
+        journal.close()
+    shards = shard_states(state_url, job_count_dict, n_workers, skip=done)
+    worker_rate = None
+    if rate is not None:
+        worker_rate = rate / len(shards)
+    worker_files = [worker_fileName(output_fileName, k)
+                    for k in range(len(shards))]
+    failed = []
+    with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+        futures = {executor.submit(scrape_states, shard, worker_files[k],
+                                   cache_options, journal_fileName,
+                                   worker_rate, fetch, parse_processes,
+                                   archive_dir, parquet_dir,
+                                   company_options): k
+                   for k, shard in enumerate(shards)}
+        for future in as_completed(futures):
+            k = futures[future]
+            try:
+                failed.extend(future.result())
+            except Exception as e:
+                print("[ERROR] Worker {} stopped: {}".format(k, e))
+                failed.extend(st for _, st, _, _ in shards[k])
+    merge_worker_files(worker_files, output_fileName)
+    return failed
+
+
+def normalize_companies(output, company_options):
+    """
+    Write the company_id layout of a finished output next to it: a listing
+    file where the company fields are replaced by the company_id of the
+    employer, and a company file with one row per employer (see
+    company_store.normalize)
+
+    Inputs:
+        output (str): the output csv file or parquet folder
+        company_options (dict): keyword arguments of CompanyStore
+    """
+    companies = company_store.CompanyStore(**company_options)
+    try:
+        paths = company_store.normalize(output, companies)
+    finally:
+        companies.close()
+    print("[INFO] Wrote {} and {}".format(*paths))
+
 
 ##################################################################
 ######################### main execution #########################
 ##################################################################
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of parallel webdriver sessions')
+    parser.add_argument('--cache', default='../data/listing_cache.sqlite',
+                        help='path of the listing cache, "none" to disable')
+    parser.add_argument('--cache-ttl-days', type=float, default=30,
+                        help='days before a cached listing is fetched again')
+    parser.add_argument('--cache-size', type=int, default=500000,
+                        help='maximum number of cached listings')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='total requests per second over all workers')
+    parser.add_argument('--fetch', choices=['http', 'selenium'], default='http',
+                        help='request listings over HTTP first, or always '
+                             'navigate the webdriver')
+    parser.add_argument('--parse-processes', type=int, default=0,
+                        help='processes parsing the listings fetched over '
+                             'HTTP while the next ones are fetched')
+    parser.add_argument('--archive', default='../data/listing_archive',
+                        help='folder of the raw html archive, "none" to '
+                             'not keep the fetched pages')
+    parser.add_argument('--reextract', action='store_true',
+                        help='rebuild the output from the archive without '
+                             'scraping')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue an interrupted run from its journal')
+    parser.add_argument('--companies', default='../data/company_store.sqlite',
+                        help='path of the company store, "none" to open the '
+                             'Company tab of every listing and not write the '
+                             'company_id listing and company files')
+    parser.add_argument('--company-ttl-days', type=float, default=90,
+                        help='days before the company fields of an employer '
+                             'are scraped again')
+    parser.add_argument('--parquet', action='store_true',
+                        help='write typed parquet files to '
+                             '../data/job_search_data.parquet instead of the '
+                             'csv file (needs pyarrow)')
+    args = parser.parse_args()
+    archive_dir = None if args.archive == 'none' else args.archive
+    parquet_dir = '../data/job_search_data.parquet' if args.parquet else None
+
+    cache_options = None
+    if args.cache != 'none':
+        cache_options = {'path': args.cache,
+                         'ttl': args.cache_ttl_days * 24 * 3600,
+                         'max_entries': args.cache_size}
+
+    company_options = None
+    if args.companies != 'none':
+        company_options = {'path': args.companies,
+                           'ttl': args.company_ttl_days * 24 * 3600}
+
+    if args.reextract:
+        # offline mode: extract the archived pages again, no scraping
+        output_fileName = "../data/job_search_data_reextracted.csv"
+        output_sink.CsvSink(output_fileName).remove()
+        companies = None
+        if company_options is not None:
+            companies = company_store.CompanyStore(**company_options)
+        try:
+            rows = html_archive.reextract(archive_dir, companies=companies)
+        finally:
+            if companies is not None:
+                print(companies.stats())
+                companies.close()
+        fileWriter(listOfTuples=CSV_HEADER + rows,
+                   output_fileName=output_fileName)
+        print("[INFO] Re-extracted {} rows into {}"
+              .format(len(rows), output_fileName))
+        if company_options is not None:
+            normalize_companies(output_fileName, company_options)
+        raise SystemExit
+
     with open('../data/state_url.txt') as f:
         state_url = f.read().splitlines()
 
@@ -116,26 +579,46 @@ if __name__ == "__main__":
         os.makedirs('data')
     # write the results into the output file
     output_fileName = "../data/job_search_data.csv"
-    csv_header = [("companyName", "company_starRating", "company_offeredRole", 
-                "company_roleLocation", "company_salary", "companyHQ", 
-                "company_founded", "company_industry", "company_revenue", 
-                "company_size", "company_type", "company_sector", 
-                "requested_url", "search_state")]
-    # write the headers to the file
-    fileWriter(listOfTuples=csv_header, output_fileName=output_fileName)
-
-    # webdriver option to not open chrome UI when scraping
-    options = Options()
-    options.headless = True
-    driver = webdriver.Chrome(options=options)
-    # if Chrome webdriver is not in yout PATH
-    # driver = webdriver.Chrome(executable_path="/path/to/chrome/webdriver", options=options)
+    journal_fileName = output_fileName + ".journal"
+    leftover_files = sorted(glob.glob(worker_fileName(output_fileName, '*')))
+    if args.resume:
+        # keep the committed rows of workers that were interrupted last time,
+        # this also cuts a torn batch off the end of the output file
+        merge_worker_files(leftover_files, output_fileName)
+        if not os.path.exists(output_fileName) and parquet_dir is None:
+            fileWriter(listOfTuples=CSV_HEADER, output_fileName=output_fileName)
+        journal = scrape_journal.ScrapeJournal(journal_fileName)
+        journal.sync_with_csv(output_fileName)
+        journal.close()
+    else:
+        for path in leftover_files + [output_fileName]:
+            output_sink.CsvSink(path).remove()
+        if os.path.exists(journal_fileName):
+            os.remove(journal_fileName)
+        if parquet_dir is not None:
+            for path in glob.glob(os.path.join(parquet_dir, 'part-*')):
+                os.remove(path)
+        else:
+            # write the headers to the file
+            fileWriter(listOfTuples=CSV_HEADER, output_fileName=output_fileName)
 
     # run the scraper python code
-    for i, st in enumerate(job_count_dict):
-        print("Scraping state No. {}: {}".format(i, st))
-        try:
-            glassdoor_scraper(driver, state_url[i], job_count_dict[st], st, output_fileName)
-        except Exception as e:
-            print(e)
-            print("[NOTE] Moving on to next state: ")
+    if args.workers > 1:
+        failed = scrape_pool(state_url, job_count_dict, output_fileName,
+                             args.workers, cache_options, journal_fileName,
+                             args.rate, args.fetch, args.parse_processes,
+                             archive_dir, parquet_dir, company_options)
+    else:
+        states = [(i, st, state_url[i], job_count_dict[st])
+                  for i, st in enumerate(job_count_dict)]
+        failed = scrape_states(states, output_fileName, cache_options,
+                               journal_fileName, args.rate, args.fetch,
+                               args.parse_processes, archive_dir, parquet_dir,
+                               company_options)
+    if failed:
+        print("[NOTE] States not scraped: {}".format(", ".join(failed)))
+
+    if company_options is not None:
+        # split the rows into listings keyed by company_id and a table of
+        # the employers
+        normalize_companies(parquet_dir or output_fileName, company_options)
@@ -15,12 +15,21 @@ X (51x1): census data for each state
 W (51x1): number of data science jobs for each state
 
 Formula: hat{beta} = inv(X'WX) * (X'WY)
+
+The census_wls function fits these regressions, and optionally the regressions
+on every combination of the census columns, all at once: the designs of the
+regressions with the same number of columns are stacked into one array and
+solved with batched NumPy QR factorizations, instead of a model fit per
+regression. The table of all the regressions is saved to
+../reg_result/census_wls.csv, and the plots use the univariate ones.
 """
 
+from itertools import combinations
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-from sklearn.linear_model import LinearRegression
+import data_cleaner
 
 
 def salary_state_plot(salary):
@@ -75,25 +84,85 @@ def ds_job_count(census):
     plt.savefig(f'../plots/{title}.png')
 
 
-def census_salary_reg(census, title_dict):
+def census_wls(census, columns, max_size=1):
+    """
+    run the WLS regressions of 'avg salary' on every combination of up to
+    max_size ACS census columns, with the number of jobs of each state as
+    weights
+    Inputs:
+        census (dataframe): the mergerd dataframe with the ACS census data and 
+                            the avg salary/job count data
+        columns (list): the ACS census columns
+        max_size (int): the largest number of columns in a regression, 1 for
+                        the univariate regressions, len(columns) for all
+                        subsets
+    Outputs:
+        fits (dataframe): a row per regression and term with the columns
+                          spec (tuple of the census columns), term ('const'
+                          or the column), coef, se, t, r2 and nobs
+    """
+    y = census['salary'].to_numpy(dtype=float)
+    w = census['count'].to_numpy(dtype=float)
+    X = census[list(columns)].to_numpy(dtype=float)
+    n = len(y)
+    sw = np.sqrt(w)
+    yw = y * sw
+    y_mean = np.sum(w * y) / np.sum(w)
+    tss = np.sum(w * (y - y_mean) ** 2)
+    # weighted columns scaled to unit norm, so that a population and a
+    # percentage are solved with the same accuracy
+    Xw = np.column_stack([sw, X * sw[:, None]])
+    scale = np.linalg.norm(Xw, axis=0)
+    Xw = Xw / scale
+
+    tables = []
+    for size in range(1, max_size + 1):
+        specs = np.array(list(combinations(range(len(columns)), size)))
+        # design of every regression of this size, intercept first:
+        # shape (regressions, states, size + 1)
+        index = np.column_stack([np.zeros(len(specs), dtype=int), specs + 1])
+        designs = Xw[:, index].transpose(1, 0, 2)
+        Q, R = np.linalg.qr(designs)
+        qty = np.einsum('mnk,n->mk', Q, yw)
+        R_inv = np.linalg.inv(R)
+        coef = np.einsum('mij,mj->mi', R_inv, qty)
+        rss = np.sum(yw ** 2) - np.sum(qty ** 2, axis=1)
+        sigma2 = rss / (n - size - 1)
+        se = np.sqrt(sigma2[:, None] * np.sum(R_inv ** 2, axis=2))
+        coef, se = coef / scale[index], se / scale[index]
+        names = np.array(['const'] + list(columns), dtype=object)
+        tables.append(pd.DataFrame({
+            'spec': [tuple(names[spec + 1]) for spec in specs
+                     for _ in range(size + 1)],
+            'term': names[index].ravel(),
+            'coef': coef.ravel(), 'se': se.ravel(),
+            't': (coef / se).ravel(),
+            'r2': np.repeat(1 - rss / tss, size + 1), 'nobs': n}))
+    return pd.concat(tables, ignore_index=True)
+
+
+def census_salary_reg(census, title_dict, fits=None):
     """
-    run an univariate WLS (weighted OLS) regression with y as 'avg salary' 
+    plot the univariate WLS (weighted OLS) regressions with y as 'avg salary' 
     and x as each ACS census columns
     Inputs:
         census (dataframe): the mergerd dataframe with the ACS census data and 
                             the avg salary/job count data
         title_dict (dictionary): the dictionary that matches ACS column names
                                 with the detailed name
+        fits (dataframe): the regressions from census_wls, None to run them
     """
-    # run and plot OLS result for each census dataframe columns
+    if fits is None:
+        fits = census_wls(census, list(title_dict))
+    # the univariate regressions, indexed by their census column and term
+    fits = fits[fits['spec'].map(len) == 1]
+    coef = fits.set_index([fits['spec'].str[0], 'term'])['coef']
+    # plot the fitted line of the regression on each census dataframe columns
     for key, val in title_dict.items():
         plt.figure(figsize=(10,6))
-        x = census[key].values.reshape(-1, 1)
+        x = census[key].values
         y = census['salary']
-        linear_regressor = LinearRegression()
-        # run OLS with the number of jobs of each state as weights
-        linear_regressor.fit(x, y, census['count'])
-        y_pred = linear_regressor.predict(x)
+        y_pred = coef[(key, 'const')] + coef[(key, key)] * x
         # differ size of the dots of the data based on the number of jobs
         plt.scatter(x, y, census['count'], color='#50a84b')
         plt.plot(x, y_pred, color='#A88743', linewidth=1.5)
@@ -179,9 +248,11 @@ def owner_cost_us_map(census):
 
 
 if __name__ == "__main__":
-    # open cleaned file
-    df = pd.read_csv('../data/cleaned_data.csv', encoding="ISO-8859-1")
-    df.drop(columns=df.columns[0], axis=1, inplace=True)
+    # open cleaned dataset, only the columns used for the plots
+    df = data_cleaner.read_cleaned(columns=['companyName',
+                                            'company_roleLocation',
+                                            'company_salary', 'job_title',
+                                            'job_seniority'])
 
     # open the ACS census data
     census = pd.read_csv('../data/ACS_data.csv')
@@ -189,16 +260,19 @@ if __name__ == "__main__":
     census_col = census.columns[1:7]
 
     # get average salary for each state
-    salary = df.groupby(['company_roleLocation'])['company_salary'].mean()
+    salary = df.groupby(['company_roleLocation'],
+                        observed=True)['company_salary'].mean()
     salary_df = salary.reset_index()
     # get the number of offered jobs for each state
-    count_jobs_dist = df.groupby(['company_roleLocation'])['companyName'].count()
+    count_jobs_dist = df.groupby(['company_roleLocation'],
+                                 observed=True)['companyName'].count()
     # merge the above two into a single data
     dist_df = pd.DataFrame({'count': list(count_jobs_dist),
                             'salary': list(salary)}, 
                             index = salary.index)
 
     # merge the ACS census data and the avg salary/job count data
+    dist_df.index = dist_df.index.astype(str)
     census = census.merge(dist_df.reset_index().rename(
         columns={"company_roleLocation": "state"}), on='state')
     col_tit_name = ['Population in Households', 'Percentage of College', 
@@ -209,18 +283,23 @@ if __name__ == "__main__":
     title_dict = dict(zip(census_col, col_tit_name))
 
     # avg salary for each job titles by descending order
-    job_salary = df.groupby(['job_title'])['company_salary'].mean()
+    job_salary = df.groupby(['job_title'], observed=True)['company_salary'].mean()
     job_salary = job_salary.sort_values()
 
     # avg salary for each job seniority by descending order
-    senior_salary = df.groupby(['job_seniority'])['company_salary'].mean()
+    senior_salary = df.groupby(['job_seniority'],
+                               observed=True)['company_salary'].mean()
     senior_salary = senior_salary.sort_values()
 
     # input the above data into plotting functions
     salary_state_plot(salary)
     ACS_descrip_stat (census, title_dict)
     ds_job_count(census)
-    census_salary_reg(census, title_dict)
+    # WLS of avg salary on every combination of the census columns
+    census_fits = census_wls(census, list(census_col), max_size=len(census_col))
+    census_fits.assign(spec=census_fits['spec'].str.join(' + ')).to_csv(
+        '../reg_result/census_wls.csv', index=False)
+    census_salary_reg(census, title_dict, census_fits)
     salary_jobtitle(job_salary)
     salary_seniority(senior_salary)
     salary_us_map(census)
@@ -0,0 +1,166 @@
+"""
+This file contains micro-benchmarks of the parsing and cleaning functions.
+Each benchmark compares the current implementation with the one it replaced
+and prints the time and the peak memory allocated per item.
+
+To compare the listing extractors over a folder of saved listing pages, e.g.
+the pages of the html archive exported with html_archive.py:
+$ python html_archive.py --export ../data/listing_html
+$ python benchmarks.py extract --corpus ../data/listing_html
+To compare the salary cleaning over a million generated salary strings:
+$ python benchmarks.py salary --rows 1000000
+"""
+
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from bs4 import BeautifulSoup as soup
+import data_cleaner
+import description_scrape
+
+
+def measure(func, items, repeat=3):
+    """
+    Run func on every item and return the best time per item (seconds) over
+    the repeats and the peak memory allocated by a single call (bytes).
+    tracemalloc only sees Python allocations, not the buffers of C libraries
+    such as lxml.
+
+    Inputs:
+        func (function): the function to benchmark, called with one item
+        items (list): the inputs of the function
+        repeat (int): number of timed passes over the items
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, (time.perf_counter() - start) / len(items))
+
+    peak = 0
+    for item in items:
+        tracemalloc.start()
+        func(item)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return best, peak
+
+
+def print_result(name, seconds, peak, baseline=None):
+    line = "{:<28} {:>10.3f} ms {:>10.1f} KiB".format(name, seconds * 1000,
+                                                      peak / 1024)
+    if baseline is not None:
+        line += "   {:.1f}x faster".format(baseline / seconds)
+    print(line)
+
+
+def bench_extract(corpus, repeat=3):
+    """
+    Compare the BeautifulSoup extractors (extract_listingBanner and
+    extract_companyInfo) with the compiled extractor (extract_fields) over
+    the saved listing pages
+
+    Inputs:
+        corpus (str): folder with the saved listing pages (*.html, *.htm)
+        repeat (int): number of timed passes over the pages
+    """
+    paths = sorted(glob.glob(os.path.join(corpus, '*.htm*')))
+    if not paths:
+        raise ValueError("No saved listing pages in {}, export them from the "
+                         "html archive with html_archive.py --export"
+                         .format(corpus))
+    pages = []
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            pages.append(f.read())
+
+    def soup_extract(src):
+        listing_soup = soup(src, 'lxml')
+        return (description_scrape.extract_listingBanner(listing_soup),
+                description_scrape.extract_companyInfo(listing_soup))
+
+    def compiled_extract(src):
+        return description_scrape.extract_fields(src)[:2]
+
+    mismatches = sum(soup_extract(src) != compiled_extract(src)
+                     for src in pages)
+    print("{} pages, {} with different results".format(len(pages), mismatches))
+    print("{:<28} {:>13} {:>14}".format("extractor", "per page", "peak alloc"))
+    soup_time, soup_peak = measure(soup_extract, pages, repeat)
+    print_result("BeautifulSoup find", soup_time, soup_peak)
+    fast_time, fast_peak = measure(compiled_extract, pages, repeat)
+    print_result("compiled XPath", fast_time, fast_peak, soup_time)
+
+
+def salary_strings(rows, seed=0):
+    """
+    Generate salary strings in the formats of the scraped company_salary
+    column: annual ranges and values in thousands, hourly ranges and values
+    """
+    rng = np.random.default_rng(seed)
+    low = rng.integers(40, 200, rows)
+    high = low + rng.integers(1, 100, rows)
+    hourly = rng.integers(1500, 9000, rows) / 100
+    kind = rng.integers(0, 4, rows)
+    formats = [
+        "Employer est.:$" + pd.Series(low).astype(str) + "K - $"
+        + pd.Series(high).astype(str) + "K ",
+        "Glassdoor est.:$" + pd.Series(low).astype(str) + "K (Employer est.)",
+        "$" + pd.Series(hourly).map("{:.2f}".format) + " - $"
+        + pd.Series(hourly + 5).map("{:.2f}".format) + " Per Hour",
+        "$" + pd.Series(hourly).map("{:.2f}".format) + " Per Hour",
+    ]
+    salaries = formats[0]
+    for k in range(1, 4):
+        salaries = salaries.where(kind != k, formats[k])
+    return salaries
+
+
+def bench_salary(rows, repeat=1):
+    """
+    Compare the cleaning of the salary column row by row (apply of
+    clean_salary) with the column-wise clean_salary_column
+
+    Inputs:
+        rows (int): number of generated salary strings
+        repeat (int): number of timed passes over the column
+    """
+    salaries = salary_strings(rows)
+    expected = salaries.apply(data_cleaner.clean_salary)
+    result = data_cleaner.clean_salary_column(salaries)['salary_mid']
+    print("{} rows, {} with different results".format(
+        rows, (expected != result).sum()))
+    print("{:<28} {:>13} {:>14}".format("salary cleaning", "per column",
+                                        "peak alloc"))
+    apply_time, apply_peak = measure(
+        lambda column: column.apply(data_cleaner.clean_salary), [salaries],
+        repeat)
+    print_result("apply(clean_salary)", apply_time, apply_peak)
+    column_time, column_peak = measure(data_cleaner.clean_salary_column,
+                                       [salaries], repeat)
+    print_result("clean_salary_column", column_time, column_peak, apply_time)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    extract_parser = subparsers.add_parser(
+        'extract', help='listing extractors over saved listing pages')
+    extract_parser.add_argument('--corpus', default='../data/listing_html',
+                                help='folder with the saved listing pages')
+    extract_parser.add_argument('--repeat', type=int, default=3)
+    salary_parser = subparsers.add_parser(
+        'salary', help='salary cleaning over generated salary strings')
+    salary_parser.add_argument('--rows', type=int, default=1000000)
+    salary_parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.benchmark == 'extract':
+        bench_extract(args.corpus, args.repeat)
+    elif args.benchmark == 'salary':
+        bench_salary(args.rows, args.repeat)
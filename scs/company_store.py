@@ -0,0 +1,257 @@
+"""
+This file is the company dimension store of the scraper. The seven company
+fields of a listing (HQ, founded, industry, revenue, size, type and sector)
+are the same for every listing of an employer, so they are stored once per
+employer in a SQLite table under a company_id. When a listing of a known
+employer is scraped, description_scrape.py skips the click on the Company tab
+and fills the company fields from the store.
+The store also splits the output of the scraper into a listing file that only
+keeps the company_id of the employer and a company file with one row per
+employer. The scraper does this at the end of every run, it can also be run on
+an existing output file or parquet folder:
+$ python company_store.py ../data/job_search_data.csv
+"""
+
+import csv
+import glob
+import os
+import sqlite3
+import sys
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# the company fields of the listing tuple, after the five banner fields
+COMPANY_START = 5
+COMPANY_END = 12
+COMPANY_COLUMNS = ("companyHQ", "company_founded", "company_industry",
+                   "company_revenue", "company_size", "company_type",
+                   "company_sector")
+
+
+class CompanyStore:
+    """
+    SQLite table of the company fields keyed by employer name
+    """
+    def __init__(self, path='../data/company_store.sqlite', ttl=90*24*3600):
+        """
+        Inputs:
+            path (str): path of the SQLite file
+            ttl (float): seconds before the fields of an employer are scraped
+                         again, None to never refresh them
+        """
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # a busy timeout lets several scraper processes share the file
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS companies (
+                                company_id INTEGER PRIMARY KEY,
+                                companyName TEXT UNIQUE NOT NULL,
+                                companyHQ TEXT, company_founded TEXT,
+                                company_industry TEXT, company_revenue TEXT,
+                                company_size TEXT, company_type TEXT,
+                                company_sector TEXT,
+                                fetched_at REAL NOT NULL)""")
+        self.conn.commit()
+
+    def get(self, companyName):
+        """
+        Return the company fields of the employer, or None if it is not
+        known or its fields have expired
+        """
+        if companyName == "NA":
+            return None
+        row = self.conn.execute(
+            "SELECT {}, fetched_at FROM companies WHERE companyName = ?"
+            .format(", ".join(COMPANY_COLUMNS)), (companyName,)).fetchone()
+        if row is None or (self.ttl is not None and
+                           time.time() - row[-1] > self.ttl):
+            return None
+        return tuple(row[:-1])
+
+    def is_known(self, companyName):
+        """
+        Check if the fields of the employer are stored and fresh, i.e. the
+        Company tab of its listings does not need to be opened
+        """
+        return self.get(companyName) is not None
+
+    def put(self, companyName, companyInfo):
+        """
+        Store the company fields of the employer. Fields that were not found
+        (all "NA") are not stored.
+        """
+        if companyName == "NA" or all(field == "NA" for field in companyInfo):
+            return
+        # an upsert keeps the company_id of a known employer
+        self.conn.execute(
+            """INSERT INTO companies (companyName, {0}, fetched_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (companyName) DO UPDATE SET {1},
+               fetched_at = excluded.fetched_at"""
+            .format(", ".join(COMPANY_COLUMNS),
+                    ", ".join("{0} = excluded.{0}".format(column)
+                              for column in COMPANY_COLUMNS)),
+            (companyName, *companyInfo, time.time()))
+        self.conn.commit()
+
+    def complete(self, listing, has_data):
+        """
+        Store the company fields of an extracted listing, or fill them from
+        the store if the page did not have them
+
+        Inputs:
+            listing (tuple): the listing tuple (see
+                             description_scrape.combine_listing)
+            has_data (bool): whether the page had the listing data
+        Outputs:
+            listing (tuple): the listing tuple with the company fields
+            has_data (bool): whether the listing is complete
+        """
+        companyName = listing[0]
+        companyInfo = listing[COMPANY_START:COMPANY_END]
+        if has_data:
+            self.put(companyName, companyInfo)
+            return listing, True
+        if not all(field == "NA" for field in companyInfo):
+            return listing, has_data
+        companyInfo = self.get(companyName)
+        if companyInfo is None:
+            self.misses += 1
+            return listing, has_data
+        self.hits += 1
+        return (listing[:COMPANY_START] + companyInfo +
+                listing[COMPANY_END:]), True
+
+    def company_ids(self):
+        """
+        Return the dictionary of employer name -> company_id
+        """
+        return dict(self.conn.execute(
+            "SELECT companyName, company_id FROM companies"))
+
+    def stats(self):
+        return ("[INFO] Company store: {} listings filled from the store, {} "
+                "unknown employers".format(self.hits, self.misses))
+
+    def close(self):
+        self.conn.close()
+
+
+def normalize_output(output_fileName, store):
+    """
+    Split an output file of the scraper into a listing file, where the
+    company fields are replaced by the company_id of the employer, and a
+    company file with one row per employer
+
+    Inputs:
+        output_fileName (str): path of the output csv file
+        store (CompanyStore): the store the employers are added to
+    Outputs:
+        listings_fileName (str): path of the listing file
+        companies_fileName (str): path of the company file
+    """
+    base = output_fileName[:-len(".csv")] if output_fileName.endswith(".csv") \
+        else output_fileName
+    listings_fileName = base + "_listings.csv"
+    companies_fileName = base + "_companies.csv"
+
+    with open(output_fileName, newline='') as f:
+        rows = list(csv.reader(f))
+    header, rows = rows[0], rows[1:]
+    for row in rows:
+        if len(row) == len(header):
+            store.put(row[0], tuple(row[COMPANY_START:COMPANY_END]))
+    company_ids = store.company_ids()
+
+    with open(listings_fileName, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(header[:COMPANY_START] + ["company_id"]
+                        + header[COMPANY_END:])
+        for row in rows:
+            if len(row) != len(header):
+                continue
+            writer.writerow(row[:COMPANY_START]
+                            + [company_ids.get(row[0], "NA")]
+                            + row[COMPANY_END:])
+    with open(companies_fileName, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(("company_id", "companyName") + COMPANY_COLUMNS)
+        writer.writerows(store.conn.execute(
+            "SELECT company_id, companyName, {} FROM companies "
+            "ORDER BY company_id".format(", ".join(COMPANY_COLUMNS))))
+    return listings_fileName, companies_fileName
+
+
+def normalize_parquet(directory, store):
+    """
+    Split the parquet output of the scraper (see output_sink.ParquetSink) the
+    same way as normalize_output, into a listing file and a company file
+
+    Inputs:
+        directory (str): folder of the parquet files
+        store (CompanyStore): the store the employers are added to
+    Outputs:
+        listings_fileName (str): path of the listing parquet file
+        companies_fileName (str): path of the company parquet file
+    """
+    if pa is None:
+        raise ImportError("pyarrow is needed to read the parquet output")
+    base = directory.rstrip(os.sep)
+    if base.endswith(".parquet"):
+        base = base[:-len(".parquet")]
+    listings_fileName = base + "_listings.parquet"
+    companies_fileName = base + "_companies.parquet"
+
+    # only the finished parts, not the .tmp file of a batch being written
+    parts = sorted(glob.glob(os.path.join(directory, 'part-*.parquet')))
+    table = pa.concat_tables([pq.read_table(part) for part in parts])
+    columns = table.to_pydict()
+    names = columns[table.column_names[0]]
+    for i, companyName in enumerate(names):
+        store.put("NA" if companyName is None else companyName,
+                  tuple("NA" if columns[column][i] is None
+                        else str(columns[column][i])
+                        for column in COMPANY_COLUMNS))
+    company_ids = store.company_ids()
+
+    listings = table.drop(list(COMPANY_COLUMNS))
+    listings = listings.add_column(
+        COMPANY_START, "company_id",
+        pa.array([company_ids.get(companyName) for companyName in names],
+                 type=pa.int64()))
+    pq.write_table(listings, listings_fileName)
+    rows = store.conn.execute(
+        "SELECT company_id, companyName, {} FROM companies "
+        "ORDER BY company_id".format(", ".join(COMPANY_COLUMNS))).fetchall()
+    header = ("company_id", "companyName") + COMPANY_COLUMNS
+    pq.write_table(pa.Table.from_pydict(
+        {column: [row[j] for row in rows] for j, column in enumerate(header)}),
+        companies_fileName)
+    return listings_fileName, companies_fileName
+
+
+def normalize(output, store):
+    """
+    Split the output of the scraper, a csv file or a parquet folder, into a
+    listing file and a company file
+    """
+    if os.path.isdir(output):
+        return normalize_parquet(output, store)
+    return normalize_output(output, store)
+
+
+if __name__ == "__main__":
+    store = CompanyStore()
+    try:
+        paths = normalize(sys.argv[1] if len(sys.argv) > 1
+                          else "../data/job_search_data.csv", store)
+    finally:
+        store.close()
+    print("[INFO] Wrote {} and {}".format(*paths))
@@ -2,24 +2,163 @@
 This file contains the cleaning process of the scraped dataset.
 As a result of executing this file, the cleaned dataset would be saved to a
 separate file under the "data" folder.
+With --chunksize, the scraped file is cleaned in chunks of rows so that it
+does not have to fit in memory. Duplicates are found across chunks with the
+hashes of the rows already seen, and the last job location of a chunk is
+carried into the next one, so the result is the same as cleaning the whole
+file at once.
+With --incremental, only the rows appended to the scraped file since the last
+chunked run are cleaned and appended to the cleaned file. The byte offset
+reached in the scraped file, the row hashes and the last job location are
+saved next to the cleaned file for the next run.
+With --processes, the per-row cleaning steps run in a process pool over
+partitions of consecutive rows, which are merged back in their order. The
+missing locations at the start of a partition are filled with the last
+location of the partitions before it, as the ffill on the whole file would.
+The cleaned dataset is also written as a typed parquet dataset partitioned by
+state (needs pyarrow), with the low-cardinality text columns as categoricals,
+so that readers can load only the columns and states they need with
+read_cleaned. Chunked and incremental runs append every cleaned chunk to it,
+and read_cleaned falls back to the csv file when the dataset is older than it.
 """
 
+import argparse
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 import re
+import shutil
+import gazetteer
+import output_sink
 
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
-def pre_process_glassdoor(df):
+
+RAW_FILE = '../data/job_search_data.csv'
+CLEANED_FILE = '../data/cleaned_data.csv'
+CLEANED_DATASET = '../data/cleaned_data.parquet'
+# rows whose salary could not be parsed, with the reason in salary_reject
+REJECT_FILE = '../data/salary_rejects.csv'
+# column types of the parquet dataset, the other columns stay strings
+CATEGORICAL_COLUMNS = ['company_roleLocation', 'job_title', 'job_seniority',
+                       'company_sector', 'company_size', 'company_type',
+                       'company_revenue', 'company_industry', 'salary_unit',
+                       'search_state', 'county_fips', 'cbsa_fips']
+# descriptive fields only: the salaries keep float64, company_salary is the
+# dependent variable of the regressions
+FLOAT32_COLUMNS = ['company_starRating']
+# file in the dataset folder whose modification time tells when the dataset
+# was last written (files starting with _ are not read as data)
+DATASET_MARKER = '_written'
+# partition of the rows whose state is missing (e.g. the first rows of the
+# scraped file, which ffill cannot fill), read back as NaN
+MISSING_STATE = 'unknown'
+# numeric columns of the scraped file, the other columns are read as strings
+# so that every chunk is read with the same types
+RAW_NUMERIC = ['company_starRating', 'company_founded']
+
+
+class ByteRange(io.RawIOBase):
+    """
+    Readable file object over a byte range of a file
+    """
+    def __init__(self, path, start, end):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.file.readinto(memoryview(buffer)[:min(len(buffer),
+                                                       self.remaining)])
+        self.remaining -= n
+        return n
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def read_raw(path=RAW_FILE, chunksize=None, start=0, end=None, names=None):
+    """
+    Read the scraped file, or an iterator over chunks of it
+    Inputs:
+        path (string): path of the scraped csv file
+        chunksize (int): number of rows per chunk, None to read the whole file
+        start, end (int): byte range of the file to read, None for the end of
+                          the file
+        names (list): the column names if start is past the header
+    Outputs:
+        df (dataframe or iterator): the scraped dataframe(s), without the
+                                    first column
+    """
+    def convert(df):
+        df = df.drop(columns=df.columns[0])
+        for column in RAW_NUMERIC:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+        return df
+
+    if start != 0 or end is not None:
+        if end is None:
+            end = os.path.getsize(path)
+        path = io.BufferedReader(ByteRange(path, start, end))
+    reader = pd.read_csv(path, encoding="ISO-8859-1", dtype=str,
+                         chunksize=chunksize, names=names,
+                         header=None if names is not None else 'infer')
+    if chunksize is None:
+        return convert(reader)
+    return (convert(chunk) for chunk in reader)
+
+
+class RowFingerprints:
+    """
+    The 64-bit hashes of the rows already seen, to drop duplicates across
+    chunks. The hashes are kept in a sorted numpy array, 8 bytes per row.
+    """
+    def __init__(self, hashes=None):
+        if hashes is None:
+            hashes = np.array([], dtype=np.uint64)
+        self.hashes = hashes
+
+    def drop_seen(self, df):
+        """
+        Drop the rows of df that were seen before and remember the others
+        """
+        hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        position = np.searchsorted(self.hashes, hashes)
+        position[position == len(self.hashes)] = 0
+        seen = (self.hashes[position] == hashes) if len(self.hashes) \
+            else np.zeros(len(hashes), dtype=bool)
+        self.hashes = np.union1d(self.hashes, hashes[~seen])
+        return df[~seen]
+
+
+def pre_process_glassdoor(df, fingerprints=None):
     """
     The pre-processing of the scraped dataset. Apply basic cleaning process before
     specified cleaning
     Inputs:
         df (dataframe): the dataframe of the glassdoor scraping result
+        fingerprints (RowFingerprints): the rows of previous chunks, None if
+                                        df is the whole file
     Outputs:
         df (dataframe): the glassdoor scraped dataframe with the cleaned result
     """
     # drop duplicates
-    df = df.drop_duplicates(subset=df.columns.difference(['requested_url']))
+    subset = df.columns.difference(['requested_url'])
+    df = df.drop_duplicates(subset=subset)
+    if fingerprints is not None:
+        df = df.loc[fingerprints.drop_seen(df[subset]).index]
     # drop rows with empty salary
     df = df.dropna(subset=['company_salary'])
     # drop remote jobs or jobs without designated workplace
@@ -149,6 +288,101 @@ def clean_salary(s):
     return salary
 
 
+# one search per row finds the first, second and a third value, the third one
+# only to reject salaries with more than two values
+ANNUAL_PATTERN = re.compile(r'\$(\d+)K(?:.*?\$(\d+)K)?(?:.*?\$(\d+)K)?',
+                            re.DOTALL)
+HOURLY_PATTERN = re.compile(
+    r'\$(\d+\.\d+)(?:.*?\$(\d+\.\d+))?(?:.*?\$(\d+\.\d+))?', re.DOTALL)
+
+
+def clean_salary_column(salaries):
+    """
+    Clean the whole salary column at once, with the same rules as clean_salary.
+    Salaries that clean_salary cannot parse are rejected instead of raising.
+    The scraped salaries repeat a lot, so every distinct string is only parsed
+    once and the results are broadcast back to the rows.
+    Inputs:
+        salaries (Series): strings containing salary info from glassdoor
+                           scraped result
+    Outputs:
+        df (dataframe): the columns salary_low, salary_high and salary_mid
+                        (thousand dollars a year, salary_mid as in
+                        clean_salary), salary_unit ("annual" or "hourly") and
+                        salary_reject (the reason, missing if parsed), with
+                        the index of salaries
+    """
+    codes, uniques = pd.factorize(salaries, use_na_sentinel=False)
+    df = parse_salaries(pd.Series(uniques).astype(str)).take(codes)
+    df.index = salaries.index
+    return df
+
+
+def parse_salaries(salaries):
+    """
+    Parse distinct salary strings, see clean_salary_column
+    """
+    annual = salaries.str.extract(ANNUAL_PATTERN).astype(float)
+    hourly = salaries.str.extract(HOURLY_PATTERN).astype(float)
+    is_annual = annual[0].notna()
+    is_hourly = ~is_annual & hourly[0].notna()
+
+    values = annual.where(is_annual, hourly)
+    low = values[0]
+    high = values[1].fillna(low)
+    mid = (low + values[1]) / 2
+    mid = mid.fillna(low)
+    # hourly to yearly, in the same order of operations as clean_salary
+    mid = mid.mask(is_hourly, mid * 40 * 52 / 1000)
+    low = low.mask(is_hourly, low * 40 * 52 / 1000)
+    high = high.mask(is_hourly, high * 40 * 52 / 1000)
+
+    reject = pd.Series(pd.NA, index=salaries.index, dtype=object)
+    reject[values[2].notna()] = 'more than two salary values'
+    reject[~is_annual & ~is_hourly] = 'no salary value'
+    rejected = reject.notna()
+    return pd.DataFrame({
+        'salary_low': low.mask(rejected),
+        'salary_high': high.mask(rejected),
+        'salary_mid': mid.mask(rejected),
+        'salary_unit': pd.Series(np.where(is_annual, 'annual', 'hourly'),
+                                 index=salaries.index).mask(rejected),
+        'salary_reject': reject})
+
+
+SENIORITY_KEYWORDS = {'senior': ['senior','sr','manager','director','principal',
+                                  'staff', 'lead', 'founding'],
+                      'junior': ['junior', 'jr'],
+                      'intern': ['intern', 'co-op']
+                      }
+JOB_TITLE_KEYWORDS = {'professor': ['professor','prof.','instructor','teacher'],
+                      'research_scientist': ['research scientist'],
+                      'machine_learning_engineer': ['machine learning', 'ml ','mle ',
+                                                    'ai ','deep learning'],
+                      'business_analytics': ['business analytics', 'business analyst',
+                                             'business data analyst', 'business intelligence',
+                                             'bi '],
+                      'software_engineer': ['software engineer', 'software developer',
+                                            'SDE'],
+                      'data_engineer': ['data engineer', 'data architect'],
+                      'data_analytics': ['data analytics', 'data analyst', 'data analysis'],
+                      'data_science': ['data science', 'data scientist']
+                      }
+
+
+def compile_keywords(keywords):
+    """
+    Compile the keyword lists of a dictionary into one regex per key, which
+    matches if any keyword is a substring
+    """
+    return {key: re.compile('|'.join(re.escape(m) for m in key_list))
+            for key, key_list in keywords.items()}
+
+
+SENIORITY_PATTERNS = compile_keywords(SENIORITY_KEYWORDS)
+JOB_TITLE_PATTERNS = compile_keywords(JOB_TITLE_KEYWORDS)
+
+
 def clean_role(s):
     """
     Clean the job title column in glassdoor dataset to make range ro value
@@ -160,41 +394,22 @@ def clean_role(s):
         title (string): the data-science related title of the input job title 
                         value given the job title dictionary
     """
-    seniority_dict = {'senior': ['senior','sr','manager','director','principal',
-                                  'staff', 'lead', 'founding'],
-                  'junior': ['junior', 'jr'],
-                  'intern': ['intern', 'co-op']
-                  }
-    job_title_dict = {'professor': ['professor','prof.','instructor','teacher'],
-                'research_scientist': ['research scientist'],
-                'machine_learning_engineer': ['machine learning', 'ml ','mle ',
-                                               'ai ','deep learning'],
-                'business_analytics': ['business analytics', 'business analyst',
-                                        'business data analyst', 'business intelligence', 
-                                        'bi '],
-                'software_engineer': ['software engineer', 'software developer', 
-                                      'SDE'],
-                'data_engineer': ['data engineer', 'data architect'],
-                'data_analytics': ['data analytics', 'data analyst', 'data analysis'],
-                'data_science': ['data science', 'data scientist']
-                }
-
-    # extract title by matching with dict
+    s = s.lower()
+
+    # extract title by matching with dict, the first matching title is kept
     title = None
-    for t,t_list in job_title_dict.items():
-        contains_title = any([m in s.lower() for m in t_list])
-        if contains_title:
+    for t, pattern in JOB_TITLE_PATTERNS.items():
+        if pattern.search(s):
             title = t
             break
     # if no match, classify as other
     if title is None:
         title = 'other title'
 
-    # extract seniority by matching with dict
+    # extract seniority by matching with dict, the last matching one is kept
     seniority = None
-    for n, n_list in seniority_dict.items():
-        contains_seniority = any([m in s.lower() for m in n_list])
-        if contains_seniority:
+    for n, pattern in SENIORITY_PATTERNS.items():
+        if pattern.search(s):
             seniority = n
     # if no match, classify as other
     if seniority is None:
@@ -203,50 +418,536 @@ def clean_role(s):
     return seniority, title
 
 
+def clean_role_column(roles):
+    """
+    Classify the whole job title column at once, with the same rules as
+    clean_role. Every distinct title is lowercased and matched once.
+    Inputs:
+        roles (Series): strings containing job title info from glassdoor
+                        scraped result
+    Outputs:
+        df (dataframe): the columns job_seniority and job_title, with the
+                        index of roles
+    """
+    codes, uniques = pd.factorize(roles, use_na_sentinel=False)
+    lowered = pd.Series(uniques).astype(str).str.lower()
+
+    title = pd.Series('other title', index=lowered.index, dtype=object)
+    matched = pd.Series(False, index=lowered.index)
+    for t, pattern in JOB_TITLE_PATTERNS.items():
+        is_title = ~matched & lowered.str.contains(pattern)
+        title[is_title] = t
+        matched |= is_title
+
+    seniority = pd.Series('no prefix', index=lowered.index, dtype=object)
+    for n, pattern in SENIORITY_PATTERNS.items():
+        seniority[lowered.str.contains(pattern)] = n
 
-def clean_pipeline(df):
+    df = pd.DataFrame({'job_seniority': seniority,
+                       'job_title': title}).take(codes)
+    df.index = roles.index
+    return df
+
+
+
+def clean_pipeline(df, gazetteer_index=None, processes=1, partition_by=None):
     """
     The data cleaning process as a whole
     Inputs:
         df (dataframe): the scraped glassdoor dataframe
+        gazetteer_index (dict): the index from gazetteer.load_index, to add the
+                                county_fips and cbsa_fips columns of the job
+                                location, or None
+        processes (int): number of processes cleaning partitions of the rows,
+                         None for one per CPU
+        partition_by (string): column whose runs of equal values are never
+                               split between partitions, e.g. "search_state",
+                               None for even row ranges
     Outputs:
         df (dataframe): the cleaned dataframe to be used for analysis
+        rejects (dataframe): the rows whose salary could not be parsed, see
+                             split_rejects
+    """
+    if processes == 1:
+        df, _ = clean_chunk(df, gazetteer_index)
+    else:
+        df = clean_parallel(df, gazetteer_index, processes, partition_by)
+    df, rejects = split_rejects(df)
+    df = df.reset_index()
+    df.drop(columns=df.columns[0], axis=1, inplace=True)
+    return df, rejects
+
+
+def split_rejects(df):
+    """
+    Split the rows whose salary could not be parsed off the cleaned rows
+    Inputs:
+        df (dataframe): the rows from clean_rows
+    Outputs:
+        df (dataframe): the cleaned rows, without the salary_reject column
+        rejects (dataframe): the rejected rows with the raw salary in
+                             company_salary_raw and the reason in
+                             salary_reject, for REJECT_FILE
+    """
+    rejected = df['salary_reject'].notna()
+    return df[~rejected].drop(columns='salary_reject'), df[rejected]
+
+
+def clean_chunk(df, gazetteer_index=None, fingerprints=None,
+                last_location=None):
+    """
+    The data cleaning process of a chunk of the scraped rows
+    Inputs:
+        df (dataframe): a chunk of the scraped glassdoor dataframe
+        gazetteer_index (dict): see clean_pipeline
+        fingerprints (RowFingerprints): the rows of previous chunks, None if
+                                        df is the whole file
+        last_location (string): the last job location of the previous chunk,
+                                to fill the missing locations at the start
+    Outputs:
+        df (dataframe): the cleaned chunk, with the index of the scraped rows
+        last_location (string): the last job location of this chunk
     """
     # apply basic data cleaning process
-    df = pre_process_glassdoor(df)
+    df = pre_process_glassdoor(df, fingerprints)
+    return clean_rows(df, gazetteer_index, last_location)
+
+
+def clean_rows(df, gazetteer_index=None, last_location=None):
+    """
+    The per-row cleaning steps, after the pre-processing
+    Inputs:
+        df (dataframe): the pre-processed rows
+        gazetteer_index (dict): see clean_pipeline
+        last_location (string): see clean_chunk
+    Outputs:
+        df (dataframe): the cleaned rows, with the index of the scraped rows,
+                        and the rows with unparsable salaries marked in the
+                        salary_reject column, see split_rejects
+        last_location (string): the last job location of the rows
+    """
+    # county and metro area of the city, before the location is cut to the state
+    if gazetteer_index is not None:
+        df = pd.concat([df, gazetteer.lookup(df['company_roleLocation'],
+                                             gazetteer_index)], axis=1)
 
     # location cleaning process
     df['company_roleLocation'] = df['company_roleLocation'].apply(clean_location)
     df.loc[df['company_roleLocation'] == 'Montgomery', 'company_roleLocation'] = 'AL'
     df['company_roleLocation'] = df['company_roleLocation'].fillna(method = 'ffill')
+    if last_location is not None:
+        df['company_roleLocation'] = df['company_roleLocation'].fillna(last_location)
+    locations = df['company_roleLocation'].dropna()
+    if len(locations) > 0:
+        last_location = locations.iloc[-1]
 
     # salary cleaning process
-    df['salary_cleaned'] = df['company_salary'].apply(clean_salary)
-    # drop if below federal minimum wage
+    salary = clean_salary_column(df['company_salary'])
+    df['salary_cleaned'] = salary['salary_mid']
+    df['salary_low'] = salary['salary_low']
+    df['salary_high'] = salary['salary_high']
+    df['salary_unit'] = salary['salary_unit']
+    df['salary_reject'] = salary['salary_reject']
+    # drop if below federal minimum wage, keep the unparsable ones for the
+    # reject file
     minwage = 7.25*40*52/1000
-    df = df[df['salary_cleaned']>=minwage]
+    df = df[(df['salary_cleaned']>=minwage) | df['salary_reject'].notna()]
     # rename salary column
     df.rename(columns={'company_salary':'company_salary_raw',
                        'salary_cleaned':'company_salary'}, 
                        inplace=True)
 
     # job title and seniority claening process
-    # for modeling later, use pd.get_dummies() to get dummies for seniority and title (and industry?)
-    seniorityf = lambda rolestr: clean_role(rolestr)[0]
-    titlef = lambda rolestr: clean_role(rolestr)[1]
+    # for modeling later, design_matrix.py builds sparse dummies of seniority, title and industry
     # add new columns
-    df['job_seniority'] = df['company_offeredRole'].apply(seniorityf)
-    df['job_title'] = df['company_offeredRole'].apply(titlef)
+    roles = clean_role_column(df['company_offeredRole'])
+    df['job_seniority'] = roles['job_seniority']
+    df['job_title'] = roles['job_title']
+    return df, last_location
 
-    df = df.reset_index()
-    df.drop(columns=df.columns[0], axis=1, inplace=True)
+
+def partition_bounds(df, n_partitions, by=None):
+    """
+    Split the rows into ranges of consecutive rows
+    Inputs:
+        df (dataframe): the rows to split
+        n_partitions (int): number of ranges of about the same size
+        by (string): column whose runs of equal values are not split, None
+                     to split anywhere
+    Outputs:
+        bounds (list): the start of every range followed by len(df)
+    """
+    bounds = np.linspace(0, len(df), n_partitions + 1).astype(int)
+    if by is not None:
+        codes, _ = pd.factorize(df[by], use_na_sentinel=False)
+        changes = np.append(np.flatnonzero(codes[1:] != codes[:-1]) + 1,
+                            len(df))
+        # move every bound forward to the start of the next run
+        bounds = changes[np.searchsorted(changes, bounds[1:-1])]
+        bounds = np.concatenate([[0], bounds, [len(df)]])
+    return sorted(set(bounds.tolist()))
+
+
+def clean_parallel(df, gazetteer_index=None, processes=None, by=None):
+    """
+    Pre-process the whole frame, then run the per-row cleaning steps on
+    partitions of it in a process pool. Gives the same rows as clean_chunk.
+    Inputs:
+        df (dataframe): the scraped glassdoor dataframe
+        gazetteer_index (dict): see clean_pipeline
+        processes (int): number of processes, None for one per CPU
+        by (string): see partition_bounds
+    Outputs:
+        df (dataframe): the cleaned rows, with the index of the scraped rows
+    """
+    # duplicates are dropped over the whole frame before it is split
+    df = pre_process_glassdoor(df)
+    processes = processes or os.cpu_count()
+    bounds = partition_bounds(df, processes, by)
+    if len(bounds) < 2:
+        return clean_rows(df, gazetteer_index)[0]
+    partitions = [df.iloc[start:end] for start, end in zip(bounds[:-1],
+                                                            bounds[1:])]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = list(executor.map(clean_rows, partitions,
+                                    [gazetteer_index] * len(partitions)))
+
+    # carry the last location of every partition into the next ones, in order
+    cleaned = []
+    last_location = None
+    for part, part_last_location in results:
+        if last_location is not None:
+            part['company_roleLocation'] = \
+                part['company_roleLocation'].fillna(last_location)
+        if part_last_location is not None:
+            last_location = part_last_location
+        cleaned.append(part)
+    return pd.concat(cleaned)
+
+
+def dataset_table(df):
+    """
+    Convert cleaned rows to an arrow table with the column types of the
+    parquet dataset. The types are set explicitly, so that tables of
+    different chunks of rows (e.g. with a column that is all missing in one
+    of them) have the same schema.
+    Inputs:
+        df (dataframe): the cleaned rows
+    Outputs:
+        table (Table): the rows, with their row numbers in the column 'row'
+    """
+    df = df.copy()
+    # a null partition value cannot be read back, missing states get a
+    # partition of their own
+    df['company_roleLocation'] = \
+        df['company_roleLocation'].fillna(MISSING_STATE).astype(str)
+    df['company_founded'] = df['company_founded'].astype('Int16')
+    # the row numbers are kept to restore the order of the rows
+    df.index.name = 'row'
+    fields = []
+    for column in df.columns:
+        if column == 'company_roleLocation':
+            field_type = pyarrow.string()
+        elif column in CATEGORICAL_COLUMNS:
+            field_type = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        elif column in FLOAT32_COLUMNS:
+            field_type = pyarrow.float32()
+        elif column == 'company_founded':
+            field_type = pyarrow.int16()
+        elif df[column].dtype == object:
+            field_type = pyarrow.string()
+        else:
+            field_type = pyarrow.from_numpy_dtype(df[column].dtype)
+        fields.append(pyarrow.field(column, field_type))
+    fields.append(pyarrow.field('row', pyarrow.int64()))
+    return pyarrow.Table.from_pandas(df, schema=pyarrow.schema(fields),
+                                     preserve_index=True)
+
+
+def write_dataset(df, directory=CLEANED_DATASET):
+    """
+    Write the cleaned dataframe as a typed parquet dataset partitioned by
+    state, replacing the previous one
+    Inputs:
+        df (dataframe): the cleaned dataframe
+        directory (string): folder of the dataset
+    """
+    if pyarrow is None:
+        raise ImportError("pyarrow is needed for the parquet dataset")
+    tmp_directory = directory + '.tmp'
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    append_dataset(df, tmp_directory)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_directory, directory)
+
+
+def append_dataset(df, directory=CLEANED_DATASET, start=0):
+    """
+    Add cleaned rows to the parquet dataset, as new files named after the
+    number of their first row
+    Inputs:
+        df (dataframe): the cleaned rows
+        directory (string): folder of the dataset
+        start (int): the number of the first row
+    """
+    pyarrow.parquet.write_to_dataset(
+        dataset_table(df), directory, partition_cols=['company_roleLocation'],
+        basename_template='rows-{:012d}-{{i}}.parquet'.format(start),
+        existing_data_behavior='overwrite_or_ignore')
+    with open(os.path.join(directory, DATASET_MARKER), 'w'):
+        pass
+
+
+def rollback_dataset(directory, n_rows):
+    """
+    Remove the files of the dataset with rows numbered n_rows or above, i.e.
+    rows written by a run that stopped before saving its state
+    """
+    for folder, _, files in os.walk(directory):
+        for name in files:
+            if name.startswith('rows-') and int(name.split('-')[1]) >= n_rows:
+                os.remove(os.path.join(folder, name))
+
+
+def dataset_is_current(directory=CLEANED_DATASET, csv_path=CLEANED_FILE):
+    """
+    Check that the parquet dataset was written after the cleaned csv file,
+    i.e. that it holds the same rows
+    """
+    marker = os.path.join(directory, DATASET_MARKER)
+    if not os.path.exists(marker):
+        return False
+    return not os.path.exists(csv_path) or \
+        os.path.getmtime(marker) >= os.path.getmtime(csv_path)
+
+
+def read_cleaned(columns=None, states=None, directory=CLEANED_DATASET,
+                 csv_path=CLEANED_FILE):
+    """
+    Read the cleaned dataset, from the parquet dataset if it is up to date
+    with the cleaned csv file, otherwise from the csv file
+    Inputs:
+        columns (list): the columns to load, None for all of them
+        states (list): the states (company_roleLocation) to load, None for
+                       all of them
+        directory (string): folder of the parquet dataset
+        csv_path (string): path of the cleaned csv file
+    Outputs:
+        df (dataframe): the cleaned rows in their original order
+    """
+    if pyarrow is not None and dataset_is_current(directory, csv_path):
+        filters = None
+        if states is not None:
+            filters = [('company_roleLocation', 'in', list(states))]
+        df = pd.read_parquet(directory, engine='pyarrow', columns=columns,
+                             filters=filters)
+        if 'company_roleLocation' in df.columns and MISSING_STATE in \
+                df['company_roleLocation'].cat.categories:
+            df['company_roleLocation'] = df['company_roleLocation'] \
+                .cat.remove_categories([MISSING_STATE])
+        return df.sort_index()
+    df = pd.read_csv(csv_path, encoding="ISO-8859-1", index_col=0)
+    if states is not None:
+        df = df[df['company_roleLocation'].isin(states)]
+    if columns is not None:
+        df = df[columns]
     return df
 
 
+def raw_checksum(path, offset, length=4096):
+    """
+    Hash of the bytes of the scraped file just before offset, to notice when
+    the part that was already cleaned has been rewritten
+    """
+    with open(path, 'rb') as f:
+        f.seek(max(0, offset - length))
+        return hashlib.sha1(f.read(min(offset, length))).hexdigest()
+
+
+def save_clean_state(output_path, state, fingerprints):
+    """
+    Save the watermark of the cleaned rows and the row hashes next to the
+    cleaned file, replacing the previous ones atomically
+    """
+    with open(output_path + ".hashes.tmp", 'wb') as f:
+        np.save(f, fingerprints.hashes)
+        f.flush()
+        os.fsync(f.fileno())
+    output_sink.fsync_replace(output_path + ".hashes.tmp",
+                              output_path + ".hashes")
+    with open(output_path + ".state.tmp", 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    output_sink.fsync_replace(output_path + ".state.tmp",
+                              output_path + ".state")
+
+
+def load_clean_state(input_path, output_path, reject_path=REJECT_FILE):
+    """
+    Read the state of the last run, None if there is none or if the scraped
+    or cleaned file does not match it anymore
+    Outputs:
+        state (dict): offset and checksum of the cleaned part of the scraped
+                      file, its column names, the last job location, the
+                      number of cleaned rows and the sizes of the cleaned
+                      and reject files
+        fingerprints (RowFingerprints): the hashes of the cleaned rows
+    """
+    try:
+        with open(output_path + ".state") as f:
+            state = json.load(f)
+        with open(output_path + ".hashes", 'rb') as f:
+            fingerprints = RowFingerprints(np.load(f))
+    except (OSError, ValueError):
+        return None, None
+    if output_sink.committed_size(input_path) < state['offset'] or \
+            raw_checksum(input_path, state['offset']) != state['checksum'] or \
+            output_sink.committed_size(output_path) < state['output_size'] or \
+            'reject_size' not in state or \
+            output_sink.committed_size(reject_path) < state['reject_size'] or \
+            len(fingerprints.hashes) != state['n_hashes']:
+        return None, None
+    return state, fingerprints
+
+
+def clean_file(input_path=RAW_FILE, output_path=CLEANED_FILE, chunksize=100000,
+               gazetteer_index=None, incremental=False,
+               dataset=CLEANED_DATASET, reject_path=REJECT_FILE):
+    """
+    Clean the scraped file chunk by chunk, appending every cleaned chunk to
+    the output file. Gives the same file as clean_pipeline on the whole file.
+    Inputs:
+        input_path (string): path of the scraped csv file
+        output_path (string): path of the cleaned csv file
+        chunksize (int): number of scraped rows per chunk
+        gazetteer_index (dict): see clean_pipeline
+        incremental (bool): only clean the rows appended to the scraped file
+                            since the last run, if its state is still valid,
+                            otherwise rebuild the cleaned file
+        dataset (string): folder of the parquet dataset, which gets the same
+                          rows as the cleaned file (needs pyarrow), None to
+                          not write it
+        reject_path (string): path of the csv file getting the rows whose
+                              salary could not be parsed
+    Outputs:
+        n_rows (int): number of cleaned rows written by this run
+    """
+    state, fingerprints = None, None
+    if incremental:
+        state, fingerprints = load_clean_state(input_path, output_path,
+                                               reject_path)
+        if state is None:
+            print("[INFO] No valid state of a previous run, rebuilding {}"
+                  .format(output_path))
+    # the committed part only, the scraper may still be appending
+    end = output_sink.committed_size(input_path)
+
+    if state is None:
+        output_sink.CsvSink(output_path).remove()
+        output_sink.CsvSink(reject_path).remove()
+        if dataset is not None:
+            shutil.rmtree(dataset, ignore_errors=True)
+        columns = list(pd.read_csv(input_path, encoding="ISO-8859-1",
+                                   nrows=0).columns)
+        state = {'offset': 0, 'columns': columns, 'last_location': None,
+                 'n_rows': 0, 'output_size': 0, 'reject_size': 0,
+                 'dataset_rows': 0}
+        fingerprints = RowFingerprints()
+        names = None
+    else:
+        names = state['columns']
+    sink = output_sink.CsvSink(output_path)
+    # rows written by a run that stopped before saving its state
+    if sink.committed > state['output_size']:
+        sink.rollback(state['output_size'])
+    reject_sink = output_sink.CsvSink(reject_path)
+    if reject_sink.committed > state['reject_size']:
+        reject_sink.rollback(state['reject_size'])
+
+    # the dataset is appended to only if it holds the rows of the cleaned
+    # file, otherwise it is removed and read_cleaned reads the csv file
+    write_parquet = dataset is not None and pyarrow is not None and \
+        state.get('dataset_rows') == state['n_rows']
+    if write_parquet:
+        rollback_dataset(dataset, state['n_rows'])
+    elif dataset is not None and os.path.exists(dataset):
+        print("[WARN] Removing {}, it does not match {}, run without "
+              "--incremental to rebuild it".format(dataset, output_path))
+        shutil.rmtree(dataset)
+
+    last_location = state['last_location']
+    n_rows = state['n_rows']
+    n_rejects = 0
+    for chunk in read_raw(input_path, chunksize, state['offset'], end, names):
+        df, last_location = clean_chunk(chunk, gazetteer_index, fingerprints,
+                                        last_location)
+        df, rejects = split_rejects(df)
+        if len(rejects):
+            reject_sink.write_bytes(rejects.to_csv(
+                header=(reject_sink.committed == 0)).encode())
+            n_rejects += len(rejects)
+        # continue the row numbers of the previous chunks
+        df.index = pd.RangeIndex(n_rows, n_rows + len(df))
+        sink.write_bytes(df.to_csv(header=(sink.committed == 0)).encode())
+        if write_parquet and len(df):
+            append_dataset(df, dataset, n_rows)
+        n_rows += len(df)
+
+    if n_rejects:
+        print("[WARN] {} rows with unparsable salaries written to {}"
+              .format(n_rejects, reject_path))
+    new_rows = n_rows - state['n_rows']
+    state.update({'offset': end, 'checksum': raw_checksum(input_path, end),
+                  'last_location': last_location, 'n_rows': n_rows,
+                  'output_size': sink.committed,
+                  'reject_size': reject_sink.committed,
+                  'dataset_rows': n_rows if write_parquet else None,
+                  'n_hashes': len(fingerprints.hashes)})
+    save_clean_state(output_path, state, fingerprints)
+    return new_rows
+
+
 if __name__ == "__main__":
-    # load datafile and apply the cleaning process
-    df = pd.read_csv('../data/job_search_data.csv', encoding="ISO-8859-1")
-    df.drop(columns=df.columns[0], axis=1, inplace=True)
-    cleaned_df = clean_pipeline(df)
-    # save the cleaned file
-    cleaned_df.to_csv('../data/cleaned_data.csv')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='clean the scraped file in chunks of this many '
+                             'rows instead of reading it whole')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only clean the rows scraped since the last '
+                             'chunked run, a run without it rebuilds the '
+                             'cleaned file')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='processes cleaning partitions of the rows, 0 '
+                             'for one per CPU')
+    parser.add_argument('--partition-by', default=None,
+                        help='column whose consecutive equal values stay in '
+                             'one partition, e.g. search_state')
+    args = parser.parse_args()
+    if args.incremental and args.chunksize is None:
+        args.chunksize = 100000
+
+    gazetteer_index = None
+    if os.path.exists(gazetteer.INDEX_FILE):
+        gazetteer_index = gazetteer.load_index(gazetteer.INDEX_FILE)
+    if args.chunksize is not None:
+        n_rows = clean_file(RAW_FILE, CLEANED_FILE, args.chunksize,
+                            gazetteer_index, args.incremental,
+                            CLEANED_DATASET)
+        print("[INFO] Cleaned {} rows into {}".format(n_rows, CLEANED_FILE))
+    else:
+        # load datafile and apply the cleaning process
+        df = read_raw(RAW_FILE)
+        cleaned_df, rejects = clean_pipeline(df, gazetteer_index,
+                                             args.processes or None,
+                                             args.partition_by)
+        # save the cleaned file and the rows it leaves out
+        cleaned_df.to_csv(CLEANED_FILE)
+        rejects.to_csv(REJECT_FILE)
+        if len(rejects):
+            print("[WARN] {} rows with unparsable salaries written to {}"
+                  .format(len(rejects), REJECT_FILE))
+        if pyarrow is not None:
+            write_dataset(cleaned_df, CLEANED_DATASET)
+        else:
+            shutil.rmtree(CLEANED_DATASET, ignore_errors=True)
@@ -6,11 +6,13 @@ This code is referenced from the 'glassdoor-scraper' repository by
 kelvinxuande.
 """
 
-from time import sleep
-import random
-from urllib.parse import urlparse
+import json
+import re
+from urllib.parse import urlparse, parse_qs
 from selenium.webdriver.common.by import By
-from bs4 import BeautifulSoup as soup
+import lxml.html
+from lxml import etree
+import rate_limiter
 
 
 # checks and corrects the scheme of the requested url
@@ -24,26 +26,41 @@ def checkURL(requested_url):
     return requested_url
         
              
-# fetches data from requested url and parses it through beautifulsoup
-def getAndParse(driver, requested_url):
+# gets the canonical id of a job listing
+def extract_listing_id(requested_url):
     """
-    Navigate to the requested url, click on the company tab, and beautiful
-    soup the page html
+    Get the jobListingId query parameter of a partner job listing url. The
+    other query parameters (pos, guid, cb, ...) change between searches, so
+    this id is what identifies the same listing across pages and states.
+    Returns None if the url has no jobListingId.
+    """
+    query = parse_qs(urlparse(checkURL(requested_url)).query)
+    listing_id = query.get("jobListingId")
+    if listing_id:
+        return listing_id[0]
+    return None
+
+
+# fetches the html of the requested url
+def getPageSource(driver, requested_url, companies=None):
+    """
+    Navigate to the requested url, click on the company tab, and return the
+    page html. If a company store is given (see company_store.py), the click
+    is skipped for the employers whose company fields are already stored.
     """
     requested_url = checkURL(requested_url)
+    rate_limiter.polite_get(driver, requested_url,
+                            ready=(By.CSS_SELECTOR, "div.css-ur1szg"))
+    if companies is not None:
+        companyName = extract_fields(driver.page_source)[0][0]
+        if companies.is_known(companyName):
+            return driver.page_source, requested_url
     try:
-        driver.get(requested_url)
-        sleep(random.uniform(10.23, 19.41))
-        try:
-            driver.find_element(By.XPATH, "//*[text()='Company']").click()
-        except Exception as e:
-            print(e)
-        src = driver.page_source
-        page_soup = soup(src, 'lxml')
-        return page_soup, requested_url
-
+        driver.find_element(By.XPATH, "//*[text()='Company']").click()
+        rate_limiter.wait_for(driver, (By.ID, "InfoFields"))
     except Exception as e:
         print(e)
+    return driver.page_source, requested_url
 
 
 # extracts desired data from listing banner
@@ -200,36 +217,323 @@ def extract_companyInfo(listing_soup):
             company_size, company_type, company_sector)
 
 
-# extract data from listing
-def extract_listing(driver, url):
+# field -> (tag, class) of the banner fields inside the banner group
+BANNER_FIELDS = {
+    "companyName": ("div", "css-16nw49e e11nt52q1"),
+    "company_starRating": ("span", "css-1pmc6te e11nt52q4"),
+    "company_offeredRole": ("div", "css-17x2pwl e11nt52q6"),
+    "company_roleLocation": ("div", "css-1v5elnn e11nt52q2"),
+    "company_salary": ("span", "small css-10zcshf e1v3ed7e1"),
+}
+BANNER_GROUP = ("div", "css-ur1szg e11nt52q0")
+
+# field -> (tag, id) of the company fields inside the company info group
+COMPANY_FIELDS = {
+    "companyHQ": ("span", "headquarters"),
+    "company_founded": ("span", "yearFounded"),
+    "company_industry": ("span", "primaryIndustry.industryName"),
+    "company_revenue": ("span", "revenue"),
+    "company_size": ("span", "size"),
+    "company_type": ("span", "type"),
+    "company_sector": ("span", "primaryIndustry.sectorName"),
+}
+COMPANY_GROUP = ("div", "InfoFields")
+# the ids of the company fields are their paths in the employer overview of
+# the page state blob, a JSON object the page is rendered from. It is in the
+# served html, so the company fields can be read without opening the tab.
+STATE_SCRIPTS = ("window.appCache", "__APOLLO_STATE__")
+STATE_ASSIGNMENT = re.compile(r"(?:{})\s*=\s*(?=\{{)".format(
+    "|".join(re.escape(marker) for marker in STATE_SCRIPTS)))
+# company fields a page needs for its company data to count as found, a
+# single field (e.g. the industry of the JSON-LD posting) is not enough
+MIN_COMPANY_FIELDS = 2
+# the company fields of the employer in the JSON-LD hiringOrganization
+ORGANIZATION_FIELDS = {"company_founded": "foundingDate",
+                       "company_size": "numberOfEmployees"}
+
+
+def compile_fields():
     """
-    Extract all relevant information from given url
+    Compile the field specs into a single XPath expression that returns every
+    field element (and the JSON-LD and page state scripts) in one evaluation,
+    and a lookup
+    table from (tag, attribute value) to the field name
     """
-    request_success = False
+    def union(fields, attribute):
+        return " or ".join("(self::{} and @{}='{}')".format(tag, attribute, value)
+                           for tag, value in fields.values())
+
+    expression = (
+        "(//{0}[@class='{1}'])[1]//*[{2}]"
+        " | (//{3}[@id='{4}'])[1]//*[{5}]"
+        " | //script[@type='application/ld+json' or @id='__NEXT_DATA__'"
+        " or {6}]"
+        .format(BANNER_GROUP[0], BANNER_GROUP[1],
+                union(BANNER_FIELDS, 'class'),
+                COMPANY_GROUP[0], COMPANY_GROUP[1],
+                union(COMPANY_FIELDS, 'id'),
+                " or ".join("contains(text(), '{}')".format(marker)
+                            for marker in STATE_SCRIPTS)))
+    lookup = {}
+    for field, (tag, value) in BANNER_FIELDS.items():
+        lookup[('class', tag, value)] = field
+    for field, (tag, value) in COMPANY_FIELDS.items():
+        lookup[('id', tag, value)] = field
+    return etree.XPath(expression), lookup
+
 
+FIELDS_XPATH, FIELDS_LOOKUP = compile_fields()
+
+
+# extracts all fields of the listing page in one pass
+def extract_fields(src):
+    """
+    Parse the listing html with lxml and extract the banner and company
+    fields with the compiled XPath expression. This gives the same values as
+    extract_listingBanner and extract_companyInfo without building a
+    BeautifulSoup tree (those two are only kept as the baseline of
+    benchmarks.py).
+    Returns the banner tuple, the company info tuple and the texts of the
+    JSON-LD and page state scripts.
+    """
+    fields = {}
+    scripts = []
     try:
-        listing_soup, requested_url = getAndParse(driver, url)
-        request_success = True
-        
-    except Exception as e:
+        tree = lxml.html.document_fromstring(src)
+    except (etree.ParserError, ValueError):
+        tree = None
+    if tree is not None:
+        for element in FIELDS_XPATH(tree):
+            if element.tag == "script":
+                scripts.append(element.text)
+                continue
+            field = FIELDS_LOOKUP.get(('class', element.tag,
+                                       element.get('class'))) or \
+                FIELDS_LOOKUP.get(('id', element.tag, element.get('id')))
+            # the first match of a field wins, like soup.find
+            if field is not None and field not in fields:
+                fields[field] = element.text_content()
+
+    company_starRating = fields.get("company_starRating", "NA")
+    companyName = fields.get("companyName", "NA")
+    if company_starRating != "NA":
+        if companyName != "NA":
+            companyName = companyName.replace(company_starRating, '')
+        company_starRating = company_starRating[:-1]
+    banner = (companyName, company_starRating,
+              fields.get("company_offeredRole", "NA"),
+              fields.get("company_roleLocation", "NA"),
+              fields.get("company_salary", "NA"))
+    companyInfo = tuple(fields.get(field, "NA") for field in COMPANY_FIELDS)
+    return banner, companyInfo, scripts
+
+
+def load_script(script):
+    """
+    Load the JSON of a JSON-LD or page state script, None if it has none.
+    The page state is assigned to a variable, e.g.
+    "window.appCache = {...};", only the object is read.
+    """
+    if not script:
+        return None
+    try:
+        return json.loads(script)
+    except ValueError:
+        pass
+    match = STATE_ASSIGNMENT.search(script)
+    if match is None:
+        return None
+    try:
+        return json.JSONDecoder().raw_decode(script, match.end())[0]
+    except ValueError:
+        return None
+
+
+def json_text(value):
+    """
+    Text of a scalar JSON value, None for missing values and objects
+    """
+    if value is None or value == "" or isinstance(value, (dict, list)):
+        return None
+    return str(value)
+
+
+def find_overview(state):
+    """
+    Find the employer overview in the page state: the first object that has
+    at least MIN_COMPANY_FIELDS of the company fields, looked up by their
+    dotted paths
+    """
+    stack = [state]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+        elif isinstance(node, dict):
+            fields = {}
+            for field, (_, path) in COMPANY_FIELDS.items():
+                value = node
+                for key in path.split("."):
+                    value = value.get(key) if isinstance(value, dict) else None
+                if json_text(value) is not None:
+                    fields[field] = json_text(value)
+            if len(fields) >= MIN_COMPANY_FIELDS:
+                return fields
+            stack.extend(reversed(list(node.values())))
+    return {}
+
+
+# reads the data embedded as JSON in the listing page
+def parse_embeddedJSON(scripts):
+    """
+    Extract the listing fields from the JSON embedded in the listing html:
+    the banner and the employer of the JobPosting JSON-LD blocks, and the
+    company fields of the employer overview in the page state. Pages fetched
+    without a browser lack the rendered banner and Company tab, but these
+    scripts are part of the served html.
+    Returns a dictionary with the fields that were found.
+    """
+    fields = {}
+    for script in scripts:
+        posting = load_script(script)
+        if not isinstance(posting, dict):
+            continue
+        if posting.get("@type") != "JobPosting":
+            # the page state wins over the JSON-LD for the company fields
+            fields.update(find_overview(posting))
+            continue
+        organization = posting.get("hiringOrganization") or {}
+        if not isinstance(organization, dict):
+            organization = {}
+        if organization.get("name"):
+            fields["companyName"] = organization["name"]
+        for field, key in ORGANIZATION_FIELDS.items():
+            value = organization.get(key)
+            if isinstance(value, dict):
+                value = value.get("value")
+            if json_text(value) is not None:
+                fields.setdefault(field, json_text(value))
+        if json_text(posting.get("industry")) is not None:
+            fields.setdefault("company_industry",
+                              json_text(posting["industry"]))
+        address = organization.get("address") or {}
+        if isinstance(address, dict):
+            place = [address.get(key) for key in
+                     ("addressLocality", "addressRegion") if address.get(key)]
+            if place:
+                fields.setdefault("companyHQ", ", ".join(place))
+        if posting.get("title"):
+            fields["company_offeredRole"] = posting["title"]
+        location = posting.get("jobLocation") or {}
+        if isinstance(location, list):
+            location = location[0] if location else {}
+        address = location.get("address") or {}
+        place = [address.get(key) for key in
+                 ("addressLocality", "addressRegion") if address.get(key)]
+        if place:
+            fields["company_roleLocation"] = ", ".join(place)
+    return fields
+
+
+# combines the extracted fields into the listing tuple
+def combine_listing(banner, companyInfo, embedded, requested_url):
+    """
+    Build the tuple that is written to the output file from the banner and
+    company info tuples. embedded is called for the embedded JSON fields only
+    if a banner or company field is missing from the rendered html.
+    """
+    companyName, company_starRating, company_offeredRole, \
+        company_roleLocation, company_salary = banner
+    companyHQ, company_founded, company_industry, company_revenue, \
+        company_size, company_type, company_sector = companyInfo
+
+    # fill in fields missing from the html with the embedded JSON
+    if "NA" in (companyName, company_offeredRole, company_roleLocation) or \
+            "NA" in companyInfo:
+        embedded = embedded()
+        if companyName == "NA":
+            companyName = embedded.get("companyName", "NA")
+        if company_offeredRole == "NA":
+            company_offeredRole = embedded.get("company_offeredRole", "NA")
+        if company_roleLocation == "NA":
+            company_roleLocation = embedded.get("company_roleLocation", "NA")
+        if "NA" in companyInfo:
+            # the fields of a Company tab that was not opened
+            companyInfo = tuple(embedded.get(field, "NA") if value == "NA"
+                                else value for field, value in
+                                zip(COMPANY_FIELDS, companyInfo))
+        companyHQ, company_founded, company_industry, company_revenue, \
+            company_size, company_type, company_sector = companyInfo
+
+    rv = (companyName, company_starRating, company_offeredRole, 
+          company_roleLocation, company_salary, companyHQ, company_founded, 
+          company_industry, company_revenue, company_size, company_type, 
+          company_sector, requested_url)
+
+    return rv
+
+
+# checks if the fetched page has the listing
+def has_listing_data(rv):
+    """
+    A lightweight fetch can return a page without the listing (e.g. a login
+    wall) or without the company data. Treat the page as empty if neither
+    the company nor the role was found, or if fewer than MIN_COMPANY_FIELDS
+    company fields were found, in the Company tab or in the embedded JSON.
+    """
+    companyName, company_offeredRole = rv[0], rv[2]
+    return (companyName != "NA" or company_offeredRole != "NA") and \
+        sum(field != "NA" for field in rv[5:12]) >= MIN_COMPANY_FIELDS
+
+
+# parse the html of a fetched listing page
+def parse_listing_html(src, requested_url):
+    """
+    Parse the raw html of a listing page into the listing tuple with the
+    compiled field extractor. This only takes and returns plain strings, so
+    that it can run in a process pool. Returns the tuple and whether the page
+    had the listing data (see has_listing_data).
+    """
+    banner, companyInfo, scripts = extract_fields(src)
+    rv = combine_listing(banner, companyInfo,
+                         lambda: parse_embeddedJSON(scripts), requested_url)
+    return rv, has_listing_data(rv)
+
+
+# extract data from listing
+def extract_listing(browser, url, fetcher=None, archive=None, companies=None):
+    """
+    Extract all relevant information from given url. The page is fetched
+    through the browser backend (fetch_backend.SeleniumFetcher). If a fetcher
+    is given (see fetch_backend.py), the page is first requested through it,
+    and the browser is only used when that returns no data. If an archive is
+    given (see html_archive.py), the html of the extracted page is stored in
+    it. If a company store is given (see company_store.py), the company
+    fields of known employers are taken from it instead of the Company tab.
+    """
+    if fetcher is not None:
+        src, requested_url = fetcher.fetch(url)
+        if src is not None:
+            rv, has_data = parse_listing_html(src, requested_url)
+            if companies is not None:
+                rv, has_data = companies.complete(rv, has_data)
+            if has_data:
+                if archive is not None:
+                    archive.put(url, src)
+                return rv
+
+    src, requested_url = browser.fetch(url)
+    if src is None:
         print("[ERROR] Error occurred in extract_listing, requested url: \
               {} is unavailable.".format(url))
         return ("NA", "NA", "NA", "NA", "NA", "NA")
 
-    if request_success:
-        companyName, company_starRating, company_offeredRole, \
-            company_roleLocation, company_salary \
-                = extract_listingBanner(listing_soup)
-        companyHQ, company_founded, company_industry, company_revenue, \
-            company_size, company_type, company_sector \
-                = extract_companyInfo(listing_soup)
-        
-        rv = (companyName, company_starRating, company_offeredRole, 
-              company_roleLocation, company_salary, companyHQ, company_founded, 
-              company_industry, company_revenue, company_size, company_type, 
-              company_sector, requested_url)
-
-        return rv
+    if archive is not None:
+        archive.put(url, src)
+    rv, has_data = parse_listing_html(src, requested_url)
+    if companies is not None:
+        rv, has_data = companies.complete(rv, has_data)
+    return rv
 
 
 # extract listing urls
@@ -0,0 +1,281 @@
+"""
+This file builds sparse design matrices from the categorical columns of the
+cleaned dataset (e.g. job_seniority, job_title, company_industry, companyName
+and company_roleLocation), instead of dense pd.get_dummies() columns that grow
+as rows x levels.
+Every categorical column becomes a CSR block with one entry per row. The
+column of each level comes from a level dictionary that is saved with the
+design: new levels are appended at the end, so the columns of the known
+levels stay the same when the design is rebuilt on newer data.
+A design is saved as the three arrays of the CSR matrix (.npy files) and a
+json file with its shape, column names and level dictionaries, and it can be
+loaded back as memory-mapped arrays. The regression and aggregation helpers
+below only multiply with the matrix (X'X, X'y, group sums), so the design is
+never densified.
+
+$ python design_matrix.py --categorical job_seniority job_title company_industry company_roleLocation
+"""
+
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+from scipy import linalg, sparse, stats
+from scipy.linalg import lapack
+import data_cleaner
+
+
+DESIGN_DIR = '../data/design'
+CATEGORICAL = ['job_seniority', 'job_title', 'company_industry',
+               'company_roleLocation']
+NUMERIC = ['company_starRating', 'company_founded']
+# pivots of the Cholesky factorization below this (relative to the largest
+# diagonal) mark columns that are linear combinations of others
+RANK_TOLERANCE = 1e-10
+
+
+class Levels:
+    """
+    Level dictionary of a categorical column: level -> column of its dummy.
+    Missing values are a level of their own (None), as in
+    regressions.group_codes.
+    """
+    def __init__(self, levels=()):
+        """
+        Inputs:
+            levels (list): the levels in the order of their columns
+        """
+        self.levels = []
+        self.index = {}
+        self.extend(levels)
+
+    def extend(self, levels):
+        for level in levels:
+            if level not in self.index:
+                self.index[level] = len(self.levels)
+                self.levels.append(level)
+
+    def update(self, values):
+        """
+        Add the levels of values that are not known yet, sorted, after the
+        known ones
+        """
+        values = pd.Series(values, dtype=object)
+        new = [level for level in pd.unique(values.dropna())
+               if level not in self.index]
+        self.extend(sorted(new))
+        if values.isna().any():
+            self.extend([None])
+        return self
+
+    def codes(self, values):
+        """
+        Map a column to the codes of its levels, -1 for unknown levels
+        """
+        values = pd.Series(values, dtype=object)
+        codes = values.map(self.index)
+        if None in self.index:
+            codes[values.isna()] = self.index[None]
+        return codes.fillna(-1).to_numpy(dtype=np.int64)
+
+    def __len__(self):
+        return len(self.levels)
+
+
+def one_hot(codes, n_levels, drop=None, dtype=np.float64):
+    """
+    Build the CSR one-hot block of a column of level codes
+    Inputs:
+        codes (array): the level code of every row, -1 for no level
+        n_levels (int): the number of levels
+        drop (int): the code of the reference level that gets no column,
+                    None to keep every level
+        dtype: the type of the entries
+    Outputs:
+        block (csr_matrix): shape (rows, levels), one entry per row
+    """
+    codes = np.asarray(codes)
+    keep = codes >= 0
+    columns = codes
+    if drop is not None:
+        keep &= codes != drop
+        columns = codes - (codes > drop)
+        n_levels -= 1
+    indptr = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(keep, out=indptr[1:])
+    return sparse.csr_matrix(
+        (np.ones(int(keep.sum()), dtype=dtype),
+         columns[keep].astype(np.int32), indptr),
+        shape=(len(codes), n_levels))
+
+
+def build_design(df, categorical=CATEGORICAL, numeric=(), levels=None,
+                 intercept=True, drop_first=True):
+    """
+    Build the sparse design matrix of the numeric and categorical columns
+    Inputs:
+        df (dataframe): e.g. the cleaned dataset
+        categorical (list): the categorical columns
+        numeric (list): the numeric columns, rows with missing values should
+                        be dropped before
+        levels (dict): the level dictionaries of a previous design, None to
+                       build new ones
+        intercept (bool): whether to add a constant column
+        drop_first (bool): whether to leave out the first level of every
+                           categorical column (needed with an intercept)
+    Outputs:
+        X (csr_matrix): the design matrix
+        names (list): the column names, "column=level" for the dummies
+        levels (dict): the level dictionaries, updated with the new levels
+    """
+    levels = {} if levels is None else levels
+    blocks, names = [], []
+    if intercept:
+        blocks.append(sparse.csr_matrix(np.ones((len(df), 1))))
+        names.append('Constant')
+    if numeric:
+        blocks.append(sparse.csr_matrix(df[list(numeric)]
+                                        .to_numpy(dtype=float)))
+        names.extend(numeric)
+    for column in categorical:
+        column_levels = levels.setdefault(column, Levels()).update(df[column])
+        drop = 0 if drop_first else None
+        blocks.append(one_hot(column_levels.codes(df[column]),
+                              len(column_levels), drop))
+        names.extend('{}={}'.format(column, level)
+                     for level in column_levels.levels[drop_first:])
+    return sparse.hstack(blocks, format='csr'), names, levels
+
+
+def save_design(X, names, levels, directory=DESIGN_DIR):
+    """
+    Save a design matrix as .npy arrays and a json file of its columns
+    """
+    os.makedirs(directory, exist_ok=True)
+    for array in ('data', 'indices', 'indptr'):
+        np.save(os.path.join(directory, array + '.npy'), getattr(X, array))
+    with open(os.path.join(directory, 'columns.json'), 'w') as f:
+        json.dump({'shape': X.shape, 'names': names,
+                   'levels': {column: column_levels.levels
+                              for column, column_levels in levels.items()}},
+                  f)
+
+
+def load_design(directory=DESIGN_DIR, mmap=True):
+    """
+    Load a saved design matrix
+    Inputs:
+        directory (string): folder of the design
+        mmap (bool): whether to memory-map the arrays instead of reading them
+    Outputs:
+        X (csr_matrix): the design matrix, backed by the files if mmap
+        names (list): the column names
+        levels (dict): the level dictionaries, to build designs of new rows
+                       with the same columns
+    """
+    arrays = [np.load(os.path.join(directory, array + '.npy'),
+                      mmap_mode='r' if mmap else None)
+              for array in ('data', 'indices', 'indptr')]
+    with open(os.path.join(directory, 'columns.json')) as f:
+        meta = json.load(f)
+    X = sparse.csr_matrix(tuple(arrays), shape=tuple(meta['shape']),
+                          copy=False)
+    levels = {column: Levels(column_levels)
+              for column, column_levels in meta['levels'].items()}
+    return X, meta['names'], levels
+
+
+def level_means(X, y):
+    """
+    Mean and count of y for every column of a one-hot block, e.g. the average
+    salary of every job title
+    Inputs:
+        X (csr_matrix): a one-hot block (drop_first=False)
+        y (array): the values to average
+    Outputs:
+        means (array): the mean of y over the rows of every level
+        counts (array): the number of rows of every level
+    """
+    counts = np.asarray(X.sum(axis=0)).ravel()
+    sums = X.T @ y
+    return np.divide(sums, counts, out=np.full(len(counts), np.nan),
+                     where=counts > 0), counts
+
+
+def normal_ols(gram, xty, yty, n, tss):
+    """
+    Solve the OLS normal equations of a regression
+    Inputs:
+        gram (array): X'X, dense (columns x columns)
+        xty (array): X'y
+        yty (float): y'y
+        n (int): the number of rows
+        tss (float): the total sum of squares of y around its mean
+    Outputs:
+        fit (dict): coef, se, pvalue (NaN for the columns that are linear
+                    combinations of others), nobs, rank and r2
+    """
+    p = len(xty)
+    # scale to unit diagonal, then a pivoted Cholesky factorization finds
+    # the independent columns
+    scale = np.sqrt(np.diag(gram))
+    scale[scale == 0] = 1
+    scaled = gram / np.outer(scale, scale)
+    _, pivots, rank, _ = lapack.dpstrf(scaled, tol=RANK_TOLERANCE)
+    keep = np.sort(pivots[:rank] - 1)
+
+    factor = linalg.cho_factor(scaled[np.ix_(keep, keep)])
+    beta = linalg.cho_solve(factor, xty[keep] / scale[keep])
+    inverse = linalg.cho_solve(factor, np.eye(rank))
+    rss = yty - beta @ (xty[keep] / scale[keep])
+    df = n - rank
+    coef = np.full(p, np.nan)
+    se = np.full(p, np.nan)
+    coef[keep] = beta / scale[keep]
+    se[keep] = np.sqrt(rss / df * np.diag(inverse)) / scale[keep]
+    return {'coef': coef, 'se': se,
+            'pvalue': 2 * stats.t.sf(np.abs(coef / se), df),
+            'nobs': n, 'rank': rank, 'r2': 1 - rss / tss}
+
+
+def sparse_ols(X, y):
+    """
+    Fit the OLS regression of y on a sparse design matrix from the normal
+    equations. Only X'X (columns x columns) is dense, so this is meant for
+    designs with up to a few thousand columns; fixed effects with more levels
+    should be absorbed (see fixed_effects.py).
+    Inputs:
+        X (csr_matrix): the design matrix
+        y (array): the dependent variable
+    Outputs:
+        fit (dict): see normal_ols
+    """
+    return normal_ols((X.T @ X).toarray(), X.T @ y, y @ y, X.shape[0],
+                      np.sum((y - y.mean()) ** 2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--categorical', nargs='+', default=CATEGORICAL)
+    parser.add_argument('--numeric', nargs='*', default=NUMERIC)
+    parser.add_argument('--output', default=DESIGN_DIR)
+    parser.add_argument('--update', action='store_true',
+                        help='keep the level dictionaries of the saved design')
+    args = parser.parse_args()
+
+    df = data_cleaner.read_cleaned()
+    df = df.dropna(subset=['company_salary'] + args.numeric)
+    levels = load_design(args.output)[2] if args.update else None
+    X, names, levels = build_design(df, args.categorical, args.numeric,
+                                    levels)
+    save_design(X, names, levels, args.output)
+    print("[INFO] Saved a {} x {} design with {} entries ({:.1f} MB) to {}"
+          .format(X.shape[0], X.shape[1], X.nnz,
+                  (X.data.nbytes + X.indices.nbytes + X.indptr.nbytes) / 1e6,
+                  args.output))
+
+    fit = sparse_ols(load_design(args.output)[0],
+                     df['company_salary'].to_numpy(dtype=float))
+    print("[INFO] OLS of company_salary: rank {}, R2 {:.3f}".format(
+        fit['rank'], fit['r2']))
@@ -0,0 +1,214 @@
+"""
+This file contains the fetch backends of description_scrape.py.
+Navigating a browser to every job listing and clicking the company tab is the
+slowest part of the scraper. The HttpFetcher requests the listing html directly
+through a pooled keep-alive session, and description_scrape.extract_listing
+only falls back to the SeleniumFetcher, which drives the webdriver, when that
+page has no data.
+The backends return the raw page html, so that the parsing can be done
+separately from the fetching.
+The HTTP backend can be checked against a local stand-in of Glassdoor that
+serves saved listing pages by their jobListingId; it reports the pages that
+would have needed the webdriver:
+$ python fetch_backend.py --pages ../data/listing_samples
+"""
+
+import argparse
+import glob
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse, urlunparse
+import requests
+from requests.adapters import HTTPAdapter
+import description_scrape
+import rate_limiter
+
+
+# headers of a regular desktop browser, the default requests headers get
+# blocked
+BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+                  "AppleWebKit/537.36 (KHTML, like Gecko) "
+                  "Chrome/110.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,"
+              "*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+
+class HttpFetcher:
+    """
+    Fetch listing pages with a pooled keep-alive HTTP session
+    """
+    def __init__(self, pool_size=10, timeout=30, base_url=None):
+        """
+        Inputs:
+            pool_size (int): number of kept-alive connections per host
+            timeout (float): seconds before a request is abandoned
+            base_url (str): scheme and host to send the requests to instead
+                            of the one in the listing url, e.g.
+                            "http://127.0.0.1:8000" for a local server that
+                            serves saved pages
+        """
+        self.timeout = timeout
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.headers.update(BROWSER_HEADERS)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def target(self, requested_url):
+        """
+        The url that is actually requested for the listing url
+        """
+        if self.base_url is None:
+            return requested_url
+        base = urlparse(self.base_url)
+        return urlunparse(urlparse(requested_url)._replace(
+            scheme=base.scheme, netloc=base.netloc))
+
+    def fetch(self, url):
+        """
+        Request the listing page
+
+        Inputs:
+            url (str): the listing url
+        Outputs:
+            src (str): the page html, or None if the request failed
+            requested_url (str): the listing url with its scheme
+        """
+        requested_url = description_scrape.checkURL(url)
+        try:
+            with rate_limiter.limiter.loading():
+                response = self.session.get(self.target(requested_url),
+                                            timeout=self.timeout)
+        except requests.RequestException as e:
+            print("[WARN] HTTP fetch failed: {}".format(e))
+            return None, requested_url
+        if response.status_code == 429 or \
+                rate_limiter.limiter.is_throttled(response.text):
+            rate_limiter.limiter.throttled()
+            return None, requested_url
+        if response.status_code != 200:
+            return None, requested_url
+        rate_limiter.limiter.succeeded()
+        # without a charset header requests falls back to Latin-1
+        if "charset" not in response.headers.get("Content-Type", ""):
+            response.encoding = "utf-8"
+        return response.text, requested_url
+
+    def close(self):
+        self.session.close()
+
+
+class SeleniumFetcher:
+    """
+    Fetch listing pages with the webdriver, clicking on the company tab
+    """
+    def __init__(self, driver, companies=None):
+        """
+        Inputs:
+            driver (webdriver object): the Chrome webdriver object
+            companies (CompanyStore): store of the company fields of known
+                                      employers, whose Company tab is not
+                                      opened, or None
+        """
+        self.driver = driver
+        self.companies = companies
+
+    def fetch(self, url):
+        """
+        Navigate to the listing page and return its html after the company
+        tab is opened, see HttpFetcher.fetch
+        """
+        try:
+            return description_scrape.getPageSource(self.driver, url,
+                                                    self.companies)
+        except Exception as e:
+            print(e)
+            return None, description_scrape.checkURL(url)
+
+    def close(self):
+        pass
+
+
+def serve_pages(directory):
+    """
+    Start a local stand-in of Glassdoor in a thread, which serves the saved
+    page <jobListingId>.html of a listing url and 404 for the others
+
+    Inputs:
+        directory (str): folder of the saved listing pages
+    Output:
+        server (ThreadingHTTPServer): the running server, its base url is
+                                      "http://127.0.0.1:<server_port>"
+    """
+    class PageHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            listing_id = parse_qs(urlparse(self.path).query).get(
+                "jobListingId", [""])[0]
+            path = os.path.join(directory, os.path.basename(listing_id)
+                                + ".html")
+            if not listing_id or not os.path.exists(path):
+                self.send_error(404)
+                return
+            with open(path, 'rb') as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class NoBrowser:
+    """
+    Stand-in of the SeleniumFetcher that records the listings that fell back
+    to the webdriver instead of loading them
+    """
+    def __init__(self):
+        self.fallbacks = []
+
+    def fetch(self, url):
+        self.fallbacks.append(url)
+        return None, description_scrape.checkURL(url)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', default='../data/listing_samples',
+                        help='folder of saved listing pages, named '
+                             '<jobListingId>.html')
+    args = parser.parse_args()
+
+    listing_ids = sorted(os.path.basename(path)[:-len(".html")] for path in
+                         glob.glob(os.path.join(args.pages, '*.html')))
+    server = serve_pages(args.pages)
+    fetcher = HttpFetcher(base_url="http://127.0.0.1:{}"
+                          .format(server.server_port))
+    browser = NoBrowser()
+    rate_limiter.configure(rate=100, burst=10, jitter=0)
+    try:
+        for listing_id in listing_ids:
+            rv = description_scrape.extract_listing(
+                browser, "www.glassdoor.com/partner/jobListing.htm?"
+                "jobListingId={}".format(listing_id), fetcher)
+            print(listing_id, rv[:12])
+    finally:
+        fetcher.close()
+        server.shutdown()
+    print("[INFO] {} of {} pages served without the webdriver".format(
+        len(listing_ids) - len(browser.fallbacks), len(listing_ids)))
+    if browser.fallbacks:
+        sys.exit(1)
@@ -0,0 +1,195 @@
+"""
+This file fits regressions with high dimensional fixed effects (e.g. company,
+state, job title and industry), as lfe::felm does in Regressions.R, without
+building a dummy column per level.
+The fixed effects are absorbed by alternating projections: the dependent
+variable and every regressor are demeaned within the groups of each fixed
+effect in turn, until the columns stop changing. The demeaned columns are the
+residuals of a regression on all the dummies, so the OLS of the demeaned
+dependent variable on the demeaned regressors gives the felm coefficients
+(Frisch-Waugh-Lovell).
+A fixed effect is stored as one integer code per row, and the group means are
+taken with a sparse (rows x levels) indicator matrix with one entry per row,
+so the memory grows with the number of rows, not with rows x levels.
+
+$ python fixed_effects.py --fixed-effects companyName company_roleLocation job_title company_industry
+"""
+
+import argparse
+import time
+import numpy as np
+from scipy import linalg, sparse, stats
+from scipy.sparse.csgraph import connected_components
+import design_matrix
+import regressions
+
+
+class FixedEffect:
+    """
+    The groups of a fixed effect: an integer code per row and the sparse
+    indicator matrix used to take group sums
+    """
+    def __init__(self, values):
+        """
+        Inputs:
+            values (Series): the level of every row, missing values are a
+                             level of their own (see regressions.group_codes)
+        """
+        self.codes, self.n_levels = regressions.group_codes(values)
+        self.indicator = design_matrix.one_hot(self.codes, self.n_levels)
+        self.counts = np.bincount(self.codes, minlength=self.n_levels)
+
+    def demean(self, columns):
+        """
+        Subtract the group means from the columns (in place)
+        Inputs:
+            columns (array): shape (rows, k)
+        """
+        means = (self.indicator.T @ columns) / self.counts[:, None]
+        columns -= means[self.codes]
+
+
+def sweep(columns, fixed_effects):
+    """
+    Demean the columns within the groups of every fixed effect in turn (in
+    place)
+    """
+    for fixed_effect in fixed_effects:
+        fixed_effect.demean(columns)
+    return columns
+
+
+def absorb(columns, fixed_effects, tol=1e-8, max_iter=10000):
+    """
+    Demean the columns within the groups of all the fixed effects by
+    alternating projections. Every iteration makes two sweeps over the fixed
+    effects and extrapolates them (Irons-Tuck acceleration), which needs far
+    fewer sweeps when the fixed effects are correlated.
+    Inputs:
+        columns (array): shape (rows, k), demeaned in place
+        fixed_effects (list): the FixedEffect of every fixed effect
+        tol (float): the iterations stop when no column changes by more than
+                     tol times its initial standard deviation
+        max_iter (int): the largest number of iterations
+    Outputs:
+        columns (array): the demeaned columns
+        iterations (int): the number of iterations
+    """
+    scale = columns.std(axis=0)
+    scale[scale == 0] = 1
+    sweep(columns, fixed_effects)
+    # a single fixed effect is absorbed exactly by one sweep
+    if len(fixed_effects) == 1:
+        return columns, 1
+    for iteration in range(1, max_iter + 1):
+        previous = columns.copy()
+        once = sweep(columns.copy(), fixed_effects)
+        twice = sweep(once.copy(), fixed_effects)
+        step = twice - once
+        if np.all(np.abs(step).max(axis=0) < tol * scale):
+            columns[:] = twice
+            return columns, iteration
+        curvature = step - (once - previous)
+        denominator = np.sum(curvature ** 2, axis=0)
+        ratio = np.divide(np.sum(step * curvature, axis=0), denominator,
+                          out=np.zeros_like(denominator),
+                          where=denominator > 0)
+        columns[:] = twice - ratio * step
+    print("[WARN] Fixed effects not absorbed after {} iterations"
+          .format(max_iter))
+    return columns, max_iter
+
+
+def fe_degrees(fixed_effects):
+    """
+    Number of parameters of the fixed effects, counted as lfe does: the
+    levels of every fixed effect, minus one reference level for every fixed
+    effect after the first, and minus the extra connected components of the
+    first two (levels that are not linked by any row cannot be separated)
+    """
+    degrees = sum(fixed_effect.n_levels for fixed_effect in fixed_effects)
+    degrees -= len(fixed_effects) - 1
+    if len(fixed_effects) >= 2:
+        first, second = fixed_effects[:2]
+        graph = sparse.csr_matrix(
+            (np.ones(len(first.codes)),
+             (first.codes, second.codes + first.n_levels)),
+            shape=(first.n_levels + second.n_levels,) * 2)
+        components = connected_components(graph, directed=False)[0]
+        degrees -= components - 1
+    return degrees
+
+
+def felm(data, regressors, fixed_effects, dependent=regressions.DEPENDENT,
+         tol=1e-8):
+    """
+    Fit the regression of dependent on regressors with absorbed fixed effects
+    Inputs:
+        data (dataframe): the data, e.g. regressions.load_data()
+        regressors (list): the regressor columns
+        fixed_effects (list): the fixed effect columns
+        dependent (string): the dependent variable column
+        tol (float): see absorb
+    Outputs:
+        fit (dict): names, coef, se, pvalue (of the regressors), residuals,
+                    nobs, df (residual degrees of freedom), r2 (of the full
+                    model, as felm reports), r2_within and iterations
+    """
+    rows = data[[dependent] + regressors].notna().all(axis=1)
+    subset = data[rows]
+    groups = [FixedEffect(subset[fe]) for fe in fixed_effects]
+    y = subset[dependent].to_numpy(dtype=float)
+    columns = np.column_stack([y] + [subset[regressor].to_numpy(dtype=float)
+                                     for regressor in regressors])
+    spread = np.linalg.norm(columns - columns.mean(axis=0), axis=0)
+    columns, iterations = absorb(columns, groups, tol)
+    y_tilde, X_tilde = columns[:, 0], columns[:, 1:]
+
+    # regressors that the fixed effects absorb (e.g. a state level variable
+    # with state fixed effects) are only numerical noise after demeaning and
+    # are left out
+    absorbed = np.linalg.norm(X_tilde, axis=0) <= np.sqrt(tol) * spread[1:]
+    X_tilde[:, absorbed] = 0
+    Xs, scale, keep = regressions.independent_columns(X_tilde)
+    Q, R = linalg.qr(Xs[:, keep], mode='economic')
+    beta = linalg.solve_triangular(R, Q.T @ y_tilde)
+    residuals = y_tilde - Xs[:, keep] @ beta
+    rss = residuals @ residuals
+    n = len(y)
+    df = n - len(keep) - fe_degrees(groups)
+    R_inv = linalg.solve_triangular(R, np.eye(len(keep)))
+    se = np.sqrt(rss / df * np.sum(R_inv ** 2, axis=1))
+
+    coef = np.full(len(regressors), np.nan)
+    std_err = np.full(len(regressors), np.nan)
+    coef[keep] = beta / scale[keep]
+    std_err[keep] = se / scale[keep]
+    return {'names': list(regressors), 'coef': coef, 'se': std_err,
+            'pvalue': 2 * stats.t.sf(np.abs(coef / std_err), df),
+            'residuals': residuals, 'nobs': n, 'df': df,
+            'r2': 1 - rss / np.sum((y - y.mean()) ** 2),
+            'r2_within': 1 - rss / np.sum(y_tilde ** 2),
+            'iterations': iterations}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--regressors', nargs='+',
+                        default=regressions.STATE_VARIABLES
+                        + regressions.COMPANY_VARIABLES)
+    parser.add_argument('--fixed-effects', nargs='+',
+                        default=regressions.COMPANY_FE + ['job_title',
+                                                          'job_seniority'])
+    parser.add_argument('--tol', type=float, default=1e-8)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    fit = felm(regressions.load_data(), args.regressors, args.fixed_effects,
+               tol=args.tol)
+    print("[INFO] {} rows, {} iterations, {:.2f} s".format(
+        fit['nobs'], fit['iterations'], time.perf_counter() - start))
+    for name, coef, se, pvalue in zip(fit['names'], fit['coef'], fit['se'],
+                                      fit['pvalue']):
+        print("{:<25} {:>12.5g} {:>12.5g} {:>8.4f}".format(name, coef, se,
+                                                          pvalue))
+    print("R2 {:.3f}, within R2 {:.3f}".format(fit['r2'], fit['r2_within']))
@@ -0,0 +1,144 @@
+"""
+This file builds and reads the gazetteer index of US places, which maps a
+"city, ST" job location to the FIPS code of its county and the code of its
+core-based statistical area (CBSA, i.e. metro or micro area), so that listings
+can be joined to sub-state ACS data.
+The index is built once from two offline files and saved to
+data/gazetteer_index.csv:
+    - a place file with a row per city, its state abbreviation and the 5 digit
+      FIPS code of its county (e.g. the simplemaps "uscities.csv")
+    - optionally, the Census CBSA delineation file, converted to csv, with a
+      row per county and the CBSA code it belongs to
+Lookups normalize a whole column of locations with pandas string operations
+and map it through a dictionary, without a Python loop over the rows.
+
+To build the index:
+$ python gazetteer.py --places ../data/uscities.csv --cbsa ../data/cbsa.csv
+"""
+
+import argparse
+import pandas as pd
+
+
+INDEX_FILE = '../data/gazetteer_index.csv'
+# suffixes of the Census place names that job locations leave out
+PLACE_SUFFIXES = r'\s+(city|town|village|borough|cdp|municipality)$'
+
+
+def normalize_places(city, state):
+    """
+    Build the lookup keys "city, st" of columns of city names and state
+    abbreviations: lowercase, without periods or apostrophes, "st" and "ft"
+    spelled out and single spaces
+
+    Inputs:
+        city (Series): the city names
+        state (Series): the state abbreviations
+    Output:
+        keys (Series): the normalized "city, st" keys
+    """
+    city = (city.astype(str).str.lower()
+            .str.replace(r"[.']", '', regex=True)
+            .str.replace(r'\s+', ' ', regex=True).str.strip()
+            .str.replace(PLACE_SUFFIXES, '', regex=True)
+            .str.replace(r'^st ', 'saint ', regex=True)
+            .str.replace(r'^ft ', 'fort ', regex=True))
+    state = state.astype(str).str.strip().str.lower()
+    return city + ', ' + state
+
+
+def normalize_locations(locations):
+    """
+    Build the lookup keys of a column of "city, ST" job locations. Locations
+    without a city, e.g. "Remote" or "California", get a missing key.
+    """
+    parts = locations.astype(str).str.rsplit(',', n=1, expand=True)
+    if parts.shape[1] < 2:
+        return pd.Series(pd.NA, index=locations.index, dtype=object)
+    keys = normalize_places(parts[0], parts[1])
+    return keys.where(parts[1].notna())
+
+
+def build_index(places_path, cbsa_path=None, city_column='city',
+                state_column='state_id', county_column='county_fips'):
+    """
+    Build the index from the offline place and CBSA files
+
+    Inputs:
+        places_path (str): csv file with a row per city
+        cbsa_path (str): csv file of the CBSA delineation, None to leave the
+                         CBSA codes out
+        city_column, state_column, county_column (str): the columns of the
+            place file with the city name, the state abbreviation and the
+            county FIPS code
+    Output:
+        index (DataFrame): the columns key, county_fips, cbsa_fips, one row
+                           per key
+    """
+    places = pd.read_csv(places_path, dtype=str)
+    if 'population' in places.columns:
+        # a name shared by several places of a state keeps the largest one
+        places = places.sort_values(
+            'population', ascending=False,
+            key=lambda population: pd.to_numeric(population, errors='coerce'))
+    index = pd.DataFrame({
+        'key': normalize_places(places[city_column], places[state_column]),
+        'county_fips': places[county_column].str.zfill(5)})
+    index = index.drop_duplicates(subset='key')
+
+    if cbsa_path is None:
+        index['cbsa_fips'] = pd.NA
+    else:
+        cbsa = pd.read_csv(cbsa_path, dtype=str)
+        cbsa = pd.DataFrame({
+            'county_fips': cbsa['FIPS State Code'].str.zfill(2)
+                           + cbsa['FIPS County Code'].str.zfill(3),
+            'cbsa_fips': cbsa['CBSA Code']})
+        index = index.merge(cbsa.drop_duplicates(subset='county_fips'),
+                            on='county_fips', how='left')
+    return index.reset_index(drop=True)
+
+
+def load_index(path=INDEX_FILE):
+    """
+    Read the saved index into the dictionaries used by lookup
+
+    Output:
+        index (dict): {"county_fips": {key: code}, "cbsa_fips": {key: code}}
+    """
+    df = pd.read_csv(path, dtype=str).set_index('key')
+    return {column: df[column].dropna().to_dict()
+            for column in ('county_fips', 'cbsa_fips')}
+
+
+def lookup(locations, index):
+    """
+    Find the county and CBSA codes of a column of "city, ST" job locations
+
+    Inputs:
+        locations (Series): the job locations, e.g. company_roleLocation
+        index (dict): the index from load_index
+    Output:
+        codes (DataFrame): the columns county_fips and cbsa_fips, missing for
+                           locations not in the index, with the index of
+                           locations
+    """
+    keys = normalize_locations(locations)
+    return pd.DataFrame({column: keys.map(codes)
+                         for column, codes in index.items()},
+                        index=locations.index)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--places', required=True,
+                        help='csv file with a row per city, its state '
+                             'abbreviation and county FIPS code')
+    parser.add_argument('--cbsa', default=None,
+                        help='csv file of the Census CBSA delineation')
+    parser.add_argument('--output', default=INDEX_FILE)
+    args = parser.parse_args()
+
+    index = build_index(args.places, args.cbsa)
+    index.to_csv(args.output, index=False)
+    print("[INFO] Saved {} places to {}".format(len(index), args.output))
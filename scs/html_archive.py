@@ -0,0 +1,286 @@
+"""
+This file keeps a compressed archive of the raw html of every fetched listing
+page, so that the listings can be extracted again without scraping them again
+when Glassdoor changes its page layout.
+The archive is a folder of segments. Every scraping process appends to its own
+segment: a data file of length-prefixed compressed records, and an index file
+of JSON lines with the offset of every record by jobListingId, plus the states
+whose search returned the listing. Records are compressed with zstandard if it
+is installed, otherwise with zlib.
+The offline re-extraction reads the records in parallel and rebuilds the rows
+of job_search_data.csv with description_scrape.parse_listing_html. The pages
+of known employers were fetched without the Company tab, so their company
+fields are filled from the company store, as during the scrape.
+The latest page of every listing can also be exported as plain html files,
+e.g. as the corpus of the extractor benchmark (see benchmarks.py):
+$ python html_archive.py --export ../data/listing_html
+"""
+
+import argparse
+import glob
+import json
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import description_scrape
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+RECORD_HEADER = struct.Struct('<I')
+
+
+def compress(data):
+    """
+    Compress a record, returning the codec name and the compressed bytes
+    """
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=10).compress(data)
+    return 'zlib', zlib.compress(data, 6)
+
+
+def decompress(codec, data):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstandard is needed to read this archive")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class HtmlArchive:
+    """
+    Append-only archive of listing pages, indexed by jobListingId
+    """
+    def __init__(self, directory='../data/listing_archive'):
+        """
+        Inputs:
+            directory (str): folder of the archive segments
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.segment = None
+        self.data_file = None
+        self.index_file = None
+
+    def open_segment(self):
+        """
+        Start the segment of this process on the first write
+        """
+        self.segment = "segment-{}-{}".format(int(time.time()), os.getpid())
+        path = os.path.join(self.directory, self.segment)
+        self.data_file = open(path + '.dat', 'ab')
+        self.index_file = open(path + '.idx', 'a')
+
+    def put(self, listing_url, src):
+        """
+        Append the html of a listing page to the archive
+
+        Inputs:
+            listing_url (str): the url of the listing
+            src (str): the page html
+        """
+        listing_id = description_scrape.extract_listing_id(listing_url)
+        if listing_id is None or src is None:
+            return
+        if self.segment is None:
+            self.open_segment()
+        record = json.dumps({'requested_url':
+                             description_scrape.checkURL(listing_url),
+                             'fetched_at': time.time()}).encode() \
+            + b"\n" + src.encode('utf-8')
+        codec, data = compress(record)
+        offset = self.data_file.tell()
+        self.data_file.write(RECORD_HEADER.pack(len(data)) + data)
+        # the record must be on disk before the index points to it
+        self.data_file.flush()
+        self.index_file.write(json.dumps({'listing_id': listing_id,
+                                          'offset': offset,
+                                          'length': len(data),
+                                          'codec': codec}) + "\n")
+        self.index_file.flush()
+
+    def tag(self, listing_url, state_search):
+        """
+        Record that the listing was written for a state-level search
+        """
+        listing_id = description_scrape.extract_listing_id(listing_url)
+        if listing_id is None:
+            return
+        if self.segment is None:
+            self.open_segment()
+        self.index_file.write(json.dumps({'listing_id': listing_id,
+                                          'state': state_search}) + "\n")
+        self.index_file.flush()
+
+    def close(self):
+        if self.segment is not None:
+            self.data_file.close()
+            self.index_file.close()
+
+
+def load_index(directory):
+    """
+    Read the index of every segment of the archive. A torn last line, or an
+    entry pointing past the end of its data file, is ignored.
+
+    Inputs:
+        directory (str): folder of the archive segments
+    Outputs:
+        pages (dict): listing id -> (data file, offset, length, codec) of
+                      the latest archived page of the listing
+        states (dict): listing id -> list of states that returned it
+    """
+    pages = {}
+    states = {}
+    for index_path in sorted(glob.glob(os.path.join(directory, '*.idx'))):
+        data_path = index_path[:-len('.idx')] + '.dat'
+        data_size = os.path.getsize(data_path)
+        with open(index_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                listing_id = entry['listing_id']
+                if 'state' in entry:
+                    if entry['state'] not in states.setdefault(listing_id, []):
+                        states[listing_id].append(entry['state'])
+                elif entry['offset'] + RECORD_HEADER.size + entry['length'] \
+                        <= data_size:
+                    pages[listing_id] = (data_path, entry['offset'],
+                                         entry['length'], entry['codec'])
+    return pages, states
+
+
+def read_record(data_file, offset, length, codec):
+    """
+    Read an archived page from an open data file
+
+    Outputs:
+        requested_url (str): the url of the listing
+        src (str): the page html
+    """
+    data_file.seek(offset + RECORD_HEADER.size)
+    record = decompress(codec, data_file.read(length))
+    meta, src = record.split(b"\n", 1)
+    return json.loads(meta)['requested_url'], src.decode('utf-8')
+
+
+def extract_batch(data_path, entries):
+    """
+    Re-extract a batch of pages of one data file. Runs in the process pool.
+
+    Inputs:
+        data_path (str): the data file of the segment
+        entries (list): list of (listing id, offset, length, codec)
+    Output:
+        listings (list): list of (listing id, listing tuple, has_data)
+    """
+    listings = []
+    with open(data_path, 'rb') as data_file:
+        for listing_id, offset, length, codec in entries:
+            requested_url, src = read_record(data_file, offset, length, codec)
+            rv, has_data = description_scrape.parse_listing_html(
+                src, requested_url)
+            listings.append((listing_id, rv, has_data))
+    return listings
+
+
+def by_data_file(pages):
+    """
+    Group the pages of load_index by data file, in the order of their offset,
+    so that every data file is read sequentially
+
+    Output:
+        by_file (dict): data file -> list of (listing id, offset, length,
+                        codec)
+    """
+    by_file = {}
+    for listing_id, (data_path, offset, length, codec) in pages.items():
+        by_file.setdefault(data_path, []).append(
+            (listing_id, offset, length, codec))
+    for entries in by_file.values():
+        entries.sort(key=lambda entry: entry[1])
+    return by_file
+
+
+def export(directory, output):
+    """
+    Write the latest archived page of every listing to its own html file
+
+    Inputs:
+        directory (str): folder of the archive segments
+        output (str): folder of the html files, named <jobListingId>.html
+    Output:
+        n_pages (int): the number of pages written
+    """
+    pages, _ = load_index(directory)
+    os.makedirs(output, exist_ok=True)
+    for data_path, entries in by_data_file(pages).items():
+        with open(data_path, 'rb') as data_file:
+            for listing_id, offset, length, codec in entries:
+                _, src = read_record(data_file, offset, length, codec)
+                with open(os.path.join(output, listing_id + '.html'), 'w',
+                          encoding='utf-8') as f:
+                    f.write(src)
+    return len(pages)
+
+
+def reextract(directory, processes=None, batch_size=200, companies=None):
+    """
+    Extract every archived listing again with the current extractor, in
+    parallel, without going to the network
+
+    Inputs:
+        directory (str): folder of the archive segments
+        processes (int): number of extraction processes, None for one per CPU
+        batch_size (int): number of pages handed to a process at once
+        companies (CompanyStore): store of the company fields of known
+                                  employers, None to leave the fields of
+                                  pages without the Company tab as "NA"
+    Output:
+        rows (list): the rows of job_search_data.csv, one per listing and
+                     state that returned it
+    """
+    pages, states = load_index(directory)
+    batches = []
+    for data_path, entries in by_data_file(pages).items():
+        for i in range(0, len(entries), batch_size):
+            batches.append((data_path, entries[i:i + batch_size]))
+
+    rows = []
+    if not batches:
+        return rows
+    listings = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for batch in executor.map(extract_batch, *zip(*batches)):
+            listings.extend(batch)
+    if companies is not None:
+        # the complete pages are stored first, so that the pages without the
+        # Company tab are filled whatever the order of the archive
+        for listing_id, rv, has_data in listings:
+            if has_data:
+                companies.complete(rv, has_data)
+        listings = [(listing_id, *companies.complete(rv, has_data))
+                    for listing_id, rv, has_data in listings]
+    for listing_id, rv, _ in listings:
+        for state_search in states.get(listing_id, ["NA"]):
+            rows.append((*rv, state_search))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--archive', default='../data/listing_archive',
+                        help='folder of the archive segments')
+    parser.add_argument('--export', default='../data/listing_html',
+                        help='folder to write the archived pages to')
+    args = parser.parse_args()
+
+    n_pages = export(args.archive, args.export)
+    print("[INFO] Exported {} pages to {}".format(n_pages, args.export))
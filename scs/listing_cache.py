@@ -0,0 +1,180 @@
+"""
+This file is the on-disk cache of scraped job listings. Every listing that is
+extracted by description_scrape.py is stored in a SQLite file under its
+jobListingId, so that re-runs and overlapping state searches can reuse the
+stored result instead of navigating to the listing again.
+Only complete listings (see description_scrape.has_listing_data) are stored,
+so that a listing whose extraction failed halfway, e.g. on a login wall or a
+throttled page, is extracted again on the next run.
+Entries older than the time-to-live are ignored, and the oldest entries are
+evicted once the cache holds more than the maximum number of listings.
+"""
+
+import json
+import sqlite3
+import time
+import description_scrape
+
+
+class ListingCache:
+    """
+    SQLite cache of extracted listing tuples keyed by jobListingId
+    """
+    def __init__(self, path='../data/listing_cache.sqlite', ttl=30*24*3600,
+                 max_entries=500000):
+        """
+        Inputs:
+            path (str): path of the SQLite file
+            ttl (float): seconds an entry stays valid, None to never expire
+            max_entries (int): number of listings kept before evicting the
+                               oldest ones, None for no limit
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        # a busy timeout lets several scraper processes share the file
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS listings (
+                                listing_id TEXT PRIMARY KEY,
+                                listing TEXT NOT NULL,
+                                fetched_at REAL NOT NULL)""")
+        self.conn.execute("""CREATE INDEX IF NOT EXISTS listings_fetched_at
+                             ON listings (fetched_at)""")
+        self.conn.commit()
+
+    def get(self, listing_url):
+        """
+        Return the cached listing tuple for the url, or None if the listing is
+        not cached, has expired or is incomplete (stored by an earlier
+        version of the cache)
+        """
+        listing_id = description_scrape.extract_listing_id(listing_url)
+        if listing_id is None:
+            self.misses += 1
+            return None
+        row = self.conn.execute(
+            "SELECT listing, fetched_at FROM listings WHERE listing_id = ?",
+            (listing_id,)).fetchone()
+        if row is None or (self.ttl is not None and
+                           time.time() - row[1] > self.ttl):
+            self.misses += 1
+            return None
+        listing = tuple(json.loads(row[0]))
+        if not description_scrape.has_listing_data(listing):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return listing
+
+    def put(self, listing_url, listing):
+        """
+        Store the extracted listing tuple for the url. Failed and partial
+        extractions (without the listing or the company data) are not stored
+        so that they are retried next time.
+        """
+        listing_id = description_scrape.extract_listing_id(listing_url)
+        if listing_id is None or \
+                not description_scrape.has_listing_data(listing):
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO listings VALUES (?, ?, ?)",
+            (listing_id, json.dumps(list(listing)), time.time()))
+        self.conn.commit()
+        # eviction scans the table, so only run it every 100 new listings
+        self.puts += 1
+        if self.puts % 100 == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete expired entries and the oldest entries above max_entries
+        """
+        if self.ttl is not None:
+            self.conn.execute("DELETE FROM listings WHERE fetched_at < ?",
+                              (time.time() - self.ttl,))
+        if self.max_entries is not None:
+            self.conn.execute("""DELETE FROM listings WHERE listing_id IN (
+                                    SELECT listing_id FROM listings
+                                    ORDER BY fetched_at DESC
+                                    LIMIT -1 OFFSET ?)""",
+                              (self.max_entries,))
+        self.conn.commit()
+
+    def close(self):
+        self.evict()
+        self.conn.close()
+
+
+def cached_extract_listing(browser, listing_url, cache=None, fetcher=None,
+                           archive=None, companies=None):
+    """
+    Extract the listing through the cache: return the stored tuple if the
+    listing was already extracted, otherwise extract it and store the result
+
+    Inputs:
+        browser (SeleniumFetcher): the webdriver fetch backend, see
+                                   fetch_backend.py
+        listing_url (str): the url of the job listing
+        cache (ListingCache): the cache to use, None to always extract
+        fetcher (HttpFetcher): lightweight fetch backend tried before the
+                               webdriver, see fetch_backend.py
+        archive (HtmlArchive): archive of the fetched pages, or None
+        companies (CompanyStore): store of the company fields of known
+                                  employers, see company_store.py
+    Output:
+        listing (tuple): the extracted listing information
+    """
+    if cache is not None:
+        listing = cache.get(listing_url)
+        if listing is not None:
+            return listing
+    listing = description_scrape.extract_listing(browser, listing_url, fetcher,
+                                                 archive, companies)
+    if cache is not None:
+        cache.put(listing_url, listing)
+    return listing
+
+
+def cached_extract_listings(browser, listing_urls, cache=None, fetcher=None,
+                            pipeline=None, archive=None, companies=None):
+    """
+    Extract the listings of a result page through the cache. The listings
+    that are not cached are extracted one by one, or all together through
+    the fetch/parse pipeline if one is given.
+
+    Inputs:
+        browser (SeleniumFetcher): the webdriver fetch backend, see
+                                   fetch_backend.py
+        listing_urls (list): the urls of the job listings
+        cache (ListingCache): the cache to use, None to always extract
+        fetcher (HttpFetcher): lightweight fetch backend tried before the
+                               webdriver, see fetch_backend.py
+        pipeline (ListingPipeline): fetch/parse pipeline, see
+                                    scrape_pipeline.py
+        archive (HtmlArchive): archive of the fetched pages, or None
+        companies (CompanyStore): store of the company fields of known
+                                  employers, see company_store.py
+    Output:
+        listings (list): the listing tuples, in the order of listing_urls
+    """
+    if pipeline is None:
+        return [cached_extract_listing(browser, listing_url, cache, fetcher,
+                                       archive, companies)
+                for listing_url in listing_urls]
+
+    listings = [None] * len(listing_urls)
+    missing = []
+    for i, listing_url in enumerate(listing_urls):
+        if cache is not None:
+            listings[i] = cache.get(listing_url)
+        if listings[i] is None:
+            missing.append(i)
+    extracted = pipeline.run(browser, [listing_urls[i] for i in missing])
+    for i, listing in zip(missing, extracted):
+        listings[i] = listing
+        if cache is not None:
+            cache.put(listing_urls[i], listing)
+    return listings
@@ -14,9 +14,7 @@ import Glassdoor_scraper
 import ACS_scraper
 import data_cleaner
 import analysis_plot
-
-# import necessary library to run R file
-import subprocess
+import regressions
  
 if __name__ == "__main__":
     # print the name of this file
@@ -55,15 +53,9 @@ if __name__ == "__main__":
         analysis_plot
 
     print(f"\nRegression Runner: {sys.argv[6]}")
-    # if sixth argument is True, execute the OLS regression file in R
+    # if sixth argument is True, run the OLS regressions of Regressions.R
     if sys.argv[6] == 'True':
-        print("\nRunning R Subprocess...")
-        # Change accordingly to your Rscript.exe & R script path
-        # this is the default path for mac
-        r_path = "/usr/local/bin/Rscript"
-        script_path = "Regressions.R"
-        # Execute command
-        cmd = [r_path, script_path]
-        subprocess.check_output(cmd, universal_newlines=True)
+        print("\nRunning Regressions...")
+        regressions.run_regressions()
         
     print("\n\nExecution Complete")
@@ -0,0 +1,255 @@
+"""
+This file contains the output sinks of the Glassdoor scraper.
+Rows are buffered and written in batches. The csv sink appends a whole batch
+with a single write and fsync, then records the committed size of the file in
+a small marker file that is replaced atomically. When a sink is opened, bytes
+past the committed size (a batch torn by a crash) are cut off, so the csv file
+never ends with a partial row.
+The parquet sink writes every batch as its own typed parquet file, which is
+renamed into place once it is complete, so downstream stages can read typed
+columns instead of parsing the Latin-1 csv file. It needs pyarrow.
+"""
+
+import csv
+import io
+import os
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+def fsync_replace(tmp_path, path):
+    """
+    Move a finished temporary file into place and make the rename durable
+    """
+    os.replace(tmp_path, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def committed_size(path):
+    """
+    Size of the committed part of a csv file written by a CsvSink, without
+    repairing it, e.g. to read a file that the scraper is still writing
+    """
+    if not os.path.exists(path):
+        return 0
+    size = os.path.getsize(path)
+    if not os.path.exists(path + ".commit"):
+        return size
+    with open(path + ".commit") as f:
+        return min(size, int(f.read().strip() or 0))
+
+
+class Sink:
+    """
+    Batching logic shared by the sinks. Subclasses implement write_batch.
+    """
+    def __init__(self, batch_size=500, flush_interval=60):
+        """
+        Inputs:
+            batch_size (int): number of buffered rows that triggers a commit
+            flush_interval (float): seconds after which buffered rows are
+                                    committed even if the batch is not full
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.callbacks = []
+        self.last_commit = time.monotonic()
+
+    def write(self, rows, on_commit=None):
+        """
+        Buffer rows, committing them if the batch is full or old enough
+
+        Inputs:
+            rows (list): list of row tuples
+            on_commit (function): called once these rows are committed, e.g.
+                                  to record the page in the progress journal
+        """
+        self.buffer.extend(rows)
+        if on_commit is not None:
+            self.callbacks.append(on_commit)
+        if len(self.buffer) >= self.batch_size or \
+                time.monotonic() - self.last_commit >= self.flush_interval:
+            self.commit()
+
+    def commit(self):
+        """
+        Durably write the buffered rows and run the pending callbacks
+        """
+        if self.buffer:
+            self.write_batch(self.buffer)
+        self.buffer = []
+        self.last_commit = time.monotonic()
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        self.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CsvSink(Sink):
+    """
+    Appends batches of rows to a csv file with commit markers
+    """
+    def __init__(self, path, batch_size=500, flush_interval=60):
+        """
+        Inputs:
+            path (str): path of the csv file
+            batch_size (int): see Sink
+            flush_interval (float): see Sink
+        """
+        super().__init__(batch_size, flush_interval)
+        self.path = path
+        self.marker = path + ".commit"
+        self.committed = self.repair()
+
+    def repair(self):
+        """
+        Cut off bytes written after the last commit and return the committed
+        size. A file without a marker is taken as committed.
+        """
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if not os.path.exists(self.marker):
+            self.write_marker(size)
+            return size
+        with open(self.marker) as f:
+            committed = int(f.read().strip() or 0)
+        if size > committed:
+            print("[WARN] Removing {} bytes of a torn write from {}"
+                  .format(size - committed, self.path))
+            with open(self.path, 'r+b') as f:
+                f.truncate(committed)
+        return min(size, committed)
+
+    def write_marker(self, size):
+        tmp_path = self.marker + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(str(size))
+            f.flush()
+            os.fsync(f.fileno())
+        fsync_replace(tmp_path, self.marker)
+
+    def write_batch(self, rows):
+        text = io.StringIO()
+        csv.writer(text).writerows(rows)
+        self.write_bytes(text.getvalue().encode())
+
+    def write_bytes(self, data):
+        """
+        Append already encoded csv rows in one write and commit them
+        """
+        with open(self.path, 'ab') as out:
+            out.write(data)
+            out.flush()
+            os.fsync(out.fileno())
+        self.committed += len(data)
+        self.write_marker(self.committed)
+
+    def rollback(self, size):
+        """
+        Cut the file back to an earlier committed size
+        """
+        with open(self.path, 'r+b') as f:
+            f.truncate(size)
+        self.committed = size
+        self.write_marker(size)
+
+    def read_committed(self):
+        """
+        Return the committed bytes of the file
+        """
+        if not os.path.exists(self.path):
+            return b""
+        with open(self.path, 'rb') as f:
+            return f.read(self.committed)
+
+    def remove(self):
+        """
+        Delete the csv file and its marker
+        """
+        for path in (self.path, self.marker):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# column types of the scraped rows in the parquet output
+PARQUET_TYPES = {"company_starRating": "float32", "company_founded": "int16"}
+
+
+class ParquetSink(Sink):
+    """
+    Writes every batch of rows as a typed parquet file in a folder
+    """
+    def __init__(self, directory, columns, batch_size=5000, flush_interval=300):
+        """
+        Inputs:
+            directory (str): folder of the parquet files
+            columns (tuple): the column names of the rows
+            batch_size (int): see Sink
+            flush_interval (float): see Sink
+        """
+        if pa is None:
+            raise ImportError("pyarrow is needed for the parquet output")
+        super().__init__(batch_size, flush_interval)
+        self.directory = directory
+        self.columns = list(columns)
+        self.parts = 0
+        os.makedirs(directory, exist_ok=True)
+        fields = [pa.field(column, getattr(pa, PARQUET_TYPES.get(column,
+                                                                 "string"))())
+                  for column in self.columns]
+        self.schema = pa.schema(fields)
+
+    def convert(self, column, values):
+        """
+        Convert the scraped strings of a column to its parquet type, "NA" and
+        unparsable values become nulls
+        """
+        if column not in PARQUET_TYPES:
+            return [None if value in (None, "NA") else str(value)
+                    for value in values]
+        converted = []
+        for value in values:
+            try:
+                number = float(value)
+                if PARQUET_TYPES[column].startswith("int"):
+                    number = int(number)
+                converted.append(number)
+            except (TypeError, ValueError):
+                converted.append(None)
+        return converted
+
+    def write_batch(self, rows):
+        # failed extractions return fewer fields, pad them with "NA"
+        rows = [tuple(row[:-1]) + ("NA",) * (len(self.columns) - len(row))
+                + (row[-1],) if len(row) < len(self.columns) else row
+                for row in rows]
+        arrays = [pa.array(self.convert(column, values), type=field.type)
+                  for column, values, field in
+                  zip(self.columns, zip(*rows), self.schema)]
+        table = pa.Table.from_arrays(arrays, schema=self.schema)
+        name = "part-{}-{}-{:05d}.parquet".format(int(time.time()),
+                                                  os.getpid(), self.parts)
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", 'wb') as f:
+            pq.write_table(table, f)
+            f.flush()
+            os.fsync(f.fileno())
+        fsync_replace(path + ".tmp", path)
+        self.parts += 1
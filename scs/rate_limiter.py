@@ -0,0 +1,216 @@
+"""
+This file contains the rate limiter shared by the scraping files.
+Instead of sleeping a fixed random time after every page load, the scrapers
+ask the limiter for permission before each request. The limiter is a token
+bucket with random jitter: requests go out as soon as the politeness budget
+allows, and it backs off exponentially when Glassdoor answers with a captcha
+or a throttling page.
+The limiter also keeps track of how much time was spent sleeping compared with
+loading pages, which is printed at the end of a scraping run.
+"""
+
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+
+
+# titles of the pages served instead of the requested page when throttled.
+# Only the title and the challenge elements are matched: listings can contain
+# the same phrases in their descriptions.
+THROTTLE_TITLES = ["help us protect glassdoor", "just a moment...",
+                   "access denied", "too many requests", "429 too many requests",
+                   "attention required! | cloudflare"]
+TITLE_PATTERN = re.compile(r"<title[^>]*>(.*?)</title>", re.I | re.S)
+# the captcha and challenge widgets of the block pages
+CHALLENGE_PATTERN = re.compile(
+    r"<[^>]+\b(?:id|class)\s*=\s*[\"']?[^\"'>]*\b(?:px-captcha|"
+    r"challenge-form|cf-challenge|g-recaptcha|h-captcha)\b", re.I)
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter with jitter and exponential backoff
+    """
+    def __init__(self, rate=0.2, burst=1, jitter=2.0, base_backoff=30.0,
+                 max_backoff=900.0):
+        """
+        Inputs:
+            rate (float): requests per second allowed on average
+            burst (int): number of requests that can go out back to back
+            jitter (float): maximum random seconds added to every wait
+            base_backoff (float): seconds to wait after the first throttle
+            max_backoff (float): upper bound of the backoff wait
+        """
+        self.rate = rate
+        self.burst = burst
+        self.jitter = jitter
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        self.backoff = 0.0
+        self.sleep_time = 0.0
+        self.load_time = 0.0
+        self.requests = 0
+        self.throttles = 0
+        # acquire is called from several threads when fetching concurrently
+        self.lock = threading.Lock()
+
+    def sleep(self, seconds):
+        """
+        Sleep without holding the lock, then count the time
+        """
+        if seconds > 0:
+            time.sleep(seconds)
+            with self.lock:
+                self.sleep_time += seconds
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        """
+        Wait until a request is allowed by the token bucket
+        """
+        with self.lock:
+            self.refill()
+            if self.tokens < 1:
+                # sleeping with the lock held makes the other threads queue
+                # behind this request
+                wait = (1 - self.tokens) / self.rate \
+                    + random.uniform(0, self.jitter)
+                time.sleep(wait)
+                self.sleep_time += wait
+                self.refill()
+            self.tokens -= 1
+            self.requests += 1
+
+    @contextmanager
+    def loading(self):
+        """
+        Wait for a token, then time the page load run inside the context
+        """
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.loaded(time.monotonic() - start)
+
+    def loaded(self, seconds):
+        """
+        Count time spent loading pages
+        """
+        with self.lock:
+            self.load_time += seconds
+
+    def is_throttled(self, page_source):
+        """
+        Check if the page is a captcha or throttling page, from its title or
+        its challenge elements
+        """
+        match = TITLE_PATTERN.search(page_source)
+        if match is not None and \
+                " ".join(match.group(1).split()).lower() in THROTTLE_TITLES:
+            return True
+        return CHALLENGE_PATTERN.search(page_source) is not None
+
+    def throttled(self):
+        """
+        Back off after a throttling page, doubling the wait every time in a
+        row that it happens
+        """
+        with self.lock:
+            self.throttles += 1
+            self.backoff = min(self.max_backoff,
+                               max(self.base_backoff, self.backoff * 2))
+            backoff = self.backoff
+        print("[WARN] Throttled by the server, backing off {:.0f} seconds"
+              .format(backoff))
+        self.sleep(backoff + random.uniform(0, self.jitter))
+
+    def succeeded(self):
+        """
+        Reset the backoff after a page loaded normally
+        """
+        with self.lock:
+            self.backoff = 0.0
+
+    def report(self):
+        """
+        Summary of the time spent sleeping and loading pages
+        """
+        total = self.sleep_time + self.load_time
+        share = self.sleep_time / total * 100 if total > 0 else 0
+        return ("[INFO] {} requests, {} throttled: {:.0f}s sleeping, "
+                "{:.0f}s loading ({:.0f}% of the time sleeping)"
+                .format(self.requests, self.throttles, self.sleep_time,
+                        self.load_time, share))
+
+
+# the limiter shared by all scraping functions of a process
+limiter = RateLimiter()
+
+
+def configure(**kwargs):
+    """
+    Replace the shared limiter, e.g. to split the politeness budget between
+    parallel workers
+    """
+    global limiter
+    limiter = RateLimiter(**kwargs)
+    return limiter
+
+
+def polite_get(driver, url, ready=None, timeout=20, max_retries=3):
+    """
+    Load the url in the webdriver through the shared limiter and wait until
+    the page is ready, backing off and retrying when throttled
+
+    Inputs:
+        driver (webdriver object): the Chrome webdriver object
+        url (str): the url to load
+        ready (tuple): (By, locator) of an element the caller needs, None to
+                       only wait for the document to load
+        timeout (float): seconds to wait for the element
+        max_retries (int): number of retries after a throttling page
+    """
+    for attempt in range(max_retries + 1):
+        with limiter.loading():
+            driver.get(url)
+            try:
+                if ready is not None:
+                    WebDriverWait(driver, timeout).until(
+                        EC.presence_of_element_located(ready))
+            except TimeoutException:
+                pass
+        if not limiter.is_throttled(driver.page_source):
+            limiter.succeeded()
+            return
+        if attempt < max_retries:
+            limiter.throttled()
+    print("[WARN] Still throttled after {} retries: {}".format(max_retries, url))
+
+
+def wait_for(driver, locator, timeout=10):
+    """
+    Wait until an element is present, e.g. after a click. Returns False if it
+    did not show up in time.
+    """
+    start = time.monotonic()
+    try:
+        WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located(locator))
+        return True
+    except TimeoutException:
+        return False
+    finally:
+        limiter.loaded(time.monotonic() - start)
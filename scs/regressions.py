@@ -0,0 +1,426 @@
+"""
+This file runs the OLS regressions of Regressions.R in Python and saves the
+stargazer style LaTeX tables and the residual plots in the "reg_result" folder.
+
+The models of a table are nested: every column adds regressors or fixed
+effects to the previous one. The design matrix of a table is built once, with
+the columns in the order the models add them, so that every model is a column
+prefix of it. The fixed effects of the felm models are added as sparse dummy
+blocks (dropping the first level of each, see design_matrix.one_hot), so the
+design is a scipy.sparse CSR matrix and is never densified.
+X'X and X'y are computed once for the whole design, and the normal equations
+of the model on the first k columns are their leading blocks:
+    beta_k = inv(X'X[:k, :k]) * X'y[:k]
+so the design is not multiplied again for every model (see
+design_matrix.normal_ols). Consecutive models share X'X as long as they use
+the same rows (complete cases). This gives the same coefficients, standard
+errors and R-squared as lm and lfe::felm.
+"""
+
+import argparse
+import time
+from decimal import Decimal, ROUND_HALF_EVEN
+import numpy as np
+import pandas as pd
+from scipy import linalg, sparse, stats
+import matplotlib.pyplot as plt
+import data_cleaner
+import design_matrix
+
+
+ACS_FILE = '../data/ACS_data.csv'
+RESULT_DIR = '../reg_result'
+DEPENDENT = 'company_salary'
+DEP_CAPTION = 'Dependent Variable: Annual Salary (in 1000s)'
+
+STATE_VARIABLES = ['state_med_owner_cost', 'state_pct_emp_tech',
+                   'state_pct_college', 'state_pop_in_hh', 'state_med_income',
+                   'state_med_rent']
+COMPANY_VARIABLES = ['company_starRating', 'company_founded']
+COMPANY_FE = ['company_revenue', 'company_size', 'company_type',
+              'company_sector']
+
+COVARIATE_LABELS = {
+    'state_med_owner_cost': 'Median Cost to Own a Home (Monthly)',
+    'state_pct_emp_tech': 'Percentage Employed in Tech',
+    'state_pct_college': 'Percentage of College Graduates',
+    'state_pop_in_hh': 'Population (In Households)',
+    'state_med_income': 'Median Income',
+    'state_med_rent': 'Median Rent (Monthly)',
+    'company_starRating': 'Company Star Rating',
+    'company_founded': 'Year Company Was Founded'}
+FE_LABELS = {
+    'company_revenue': 'Company Revenue FE',
+    'company_size': 'Company Size FE',
+    'company_type': 'Company Type FE',
+    'company_sector': 'Company Sector FE',
+    'job_title': 'Job Title FE',
+    'job_seniority': 'Job Seniority FE'}
+
+# the tables of Regressions.R, every model is (regressors, fixed effects)
+TABLES = [
+    {'title': "Regressions on state level variables",
+     'file': 'regressions1.tex',
+     'models': [(STATE_VARIABLES[:k], [])
+                for k in range(1, len(STATE_VARIABLES) + 1)]},
+    {'title': "Regressions on state level variables with company \n"
+              "          level variables as controls",
+     'file': 'regressions2.tex',
+     'models': [(STATE_VARIABLES + COMPANY_VARIABLES[:1], []),
+                (STATE_VARIABLES + COMPANY_VARIABLES, [])]
+               + [(STATE_VARIABLES + COMPANY_VARIABLES, COMPANY_FE[:k])
+                  for k in range(1, len(COMPANY_FE) + 1)]},
+    {'title': "Regressions on state level variables with company level \n"
+              "          variables and job titles as controls",
+     'file': 'regressions3.tex',
+     'models': [(STATE_VARIABLES + COMPANY_VARIABLES,
+                 COMPANY_FE + ['job_title']),
+                (STATE_VARIABLES + COMPANY_VARIABLES,
+                 COMPANY_FE + ['job_title', 'job_seniority'])]}]
+
+# columns whose diagonal in R is below this (after scaling the columns to
+# unit norm) are linear combinations of earlier ones and get no coefficient
+RANK_TOLERANCE = 1e-9
+
+
+def load_data(acs_path=ACS_FILE):
+    """
+    Merge the cleaned Glassdoor listings with the ACS data of their state
+    Inputs:
+        acs_path (string): path of the ACS data
+    Outputs:
+        data (dataframe): a row per listing with the state level variables
+    """
+    glassdoor = data_cleaner.read_cleaned()
+    glassdoor['company_roleLocation'] = \
+        glassdoor['company_roleLocation'].astype(str)
+    acs = pd.read_csv(acs_path)
+    return glassdoor.merge(acs, left_on='company_roleLocation',
+                           right_on='state')
+
+
+def group_codes(values):
+    """
+    Integer codes of a fixed effect column. Missing values are a level of
+    their own, as the empty strings read by R.
+    """
+    codes, levels = pd.factorize(values, sort=True)
+    if (codes < 0).any():
+        codes[codes < 0] = len(levels)
+        return codes, len(levels) + 1
+    return codes, len(levels)
+
+
+def build_design(data, models):
+    """
+    Build the design matrix of a chain of nested models, with the columns in
+    the order the models add them
+    Inputs:
+        data (dataframe): the rows of the chain
+        models (list): (regressors, fixed effects) of the models, every model
+                       containing the previous one
+    Outputs:
+        X (csr_matrix): the design matrix, intercept first
+        names (list): the column names, None for the fixed effect dummies
+        sizes (list): the number of columns of each model
+    """
+    blocks, names, sizes = [], ['Constant'], []
+    # the intercept and the regressors not yet in a block
+    dense = [np.ones(len(data))]
+    used_regressors, used_fe = [], []
+    for regressors, fixed_effects in models:
+        for regressor in regressors:
+            if regressor not in used_regressors:
+                used_regressors.append(regressor)
+                dense.append(data[regressor].to_numpy(dtype=float))
+                names.append(regressor)
+        for fe in fixed_effects:
+            if fe not in used_fe:
+                used_fe.append(fe)
+                if dense:
+                    blocks.append(sparse.csr_matrix(np.column_stack(dense)))
+                    dense = []
+                codes, n_levels = group_codes(data[fe])
+                # drop the first level, the intercept takes its place
+                blocks.append(design_matrix.one_hot(codes, n_levels, drop=0))
+                names.extend([None] * (n_levels - 1))
+        sizes.append(len(names))
+    if dense:
+        blocks.append(sparse.csr_matrix(np.column_stack(dense)))
+    return sparse.hstack(blocks, format='csr'), names, sizes
+
+
+def independent_columns(X):
+    """
+    Scale the columns of X to unit norm and find the columns that are not
+    linear combinations of earlier ones
+    Inputs:
+        X (array): the design matrix
+    Outputs:
+        Xs (array): the scaled design matrix
+        scale (array): the norm of every column
+        keep (array): the positions of the independent columns
+    """
+    # scaling the columns to unit norm keeps the factorization accurate when
+    # the regressors differ by orders of magnitude (population vs percentage)
+    scale = np.linalg.norm(X, axis=0)
+    scale[scale == 0] = 1
+    Xs = X / scale
+    diag = np.abs(np.diag(linalg.qr(Xs, mode='r')[0]))
+    return Xs, scale, np.flatnonzero(diag > RANK_TOLERANCE)
+
+
+def fit_nested(X, y, sizes):
+    """
+    Fit the OLS regressions of y on the first k columns of X for every k in
+    sizes, from one X'X and X'y
+    Inputs:
+        X (csr_matrix): the design matrix
+        y (array): the dependent variable
+        sizes (list): the number of columns of each model
+    Outputs:
+        fits (list): a dictionary per model with coef, se, pvalue (arrays over
+                     the first k columns, NaN for dropped columns), residuals,
+                     nobs, rank and r2
+    """
+    gram = (X.T @ X).toarray()
+    xty = X.T @ y
+    yty = y @ y
+    tss = np.sum((y - y.mean()) ** 2)
+
+    fits = []
+    for size in sizes:
+        fit = design_matrix.normal_ols(gram[:size, :size], xty[:size], yty,
+                                       len(y), tss)
+        fit['residuals'] = y - X[:, :size] @ np.nan_to_num(fit['coef'])
+        fits.append(fit)
+    return fits
+
+
+def run_table(data, models):
+    """
+    Fit the models of a table, sharing one factorization between consecutive
+    models on the same rows
+    Inputs:
+        data (dataframe): the merged data
+        models (list): (regressors, fixed effects) of the models
+    Outputs:
+        fits (list): the fit of every model (see fit_nested), with the names
+                     of its columns and the rows it used
+    """
+    # split the models into chains of nested models on the same rows
+    chains = []
+    for regressors, fixed_effects in models:
+        rows = data[[DEPENDENT] + regressors].notna().all(axis=1)
+        if chains:
+            last_regressors, last_fe = chains[-1][0][-1]
+            if rows.equals(chains[-1][1]) and \
+                    set(last_regressors) <= set(regressors) and \
+                    set(last_fe) <= set(fixed_effects):
+                chains[-1][0].append((regressors, fixed_effects))
+                continue
+        chains.append(([(regressors, fixed_effects)], rows))
+
+    fits = []
+    for chain, rows in chains:
+        subset = data[rows]
+        X, names, sizes = build_design(subset, chain)
+        y = subset[DEPENDENT].to_numpy(dtype=float)
+        for fit, size in zip(fit_nested(X, y, sizes), sizes):
+            fit['names'] = names[:size]
+            fit['rows'] = rows
+            fits.append(fit)
+    return fits
+
+
+def format_number(value, digits=3, max_digits=5):
+    """
+    Format a coefficient as stargazer does with options(digits=3): rounded to
+    three decimals (more, up to five, for values that would round to zero),
+    then to three significant digits with ties to even as R does, and shown
+    with those decimals
+    """
+    decimals = digits
+    while round(value, decimals) == 0 and decimals < max_digits:
+        decimals += 1
+    rounded = Decimal(repr(round(abs(value), decimals)))
+    rounded = rounded.quantize(
+        Decimal(1).scaleb(rounded.adjusted() - digits + 1), ROUND_HALF_EVEN)
+    return ('$-$' if value < 0 else '') + '%.*f' % (decimals, rounded)
+
+
+def stars(pvalue):
+    if pvalue < 0.01:
+        return '$^{***}$'
+    if pvalue < 0.05:
+        return '$^{**}$'
+    if pvalue < 0.1:
+        return '$^{*}$'
+    return ''
+
+
+def stargazer_table(models, fits, title):
+    """
+    Write the fits of a table as a stargazer LaTeX table
+    Inputs:
+        models (list): (regressors, fixed effects) of the models
+        fits (list): the fits from run_table
+        title (string): the caption of the table
+    Outputs:
+        tex (string): the LaTeX table
+    """
+    m = len(models)
+    felm = [bool(fixed_effects) for _, fixed_effects in models]
+    lines = [
+        "",
+        "% Table created by regressions.py",
+        "% Date and time: " + time.strftime("%a, %b %d, %Y - %I:%M:%S %p"),
+        "\\begin{table}[!htbp] \\centering ",
+        "  \\caption{" + title + "} ",
+        "  \\label{} ",
+        "\\footnotesize ",
+        "\\begin{tabular}{@{\\extracolsep{5pt}}l" + "c" * m + "} ",
+        "\\\\[-1.8ex]\\hline ",
+        "\\hline \\\\[-1.8ex] ",
+        " & \\multicolumn{" + str(m) + "}{c}{" + DEP_CAPTION + "} \\\\ ",
+        "\\cline{2-" + str(m + 1) + "} "]
+    if len(set(felm)) > 1:
+        # the model type row, one cell per run of models of the same type
+        cells, start = [], 0
+        for i in range(1, m + 1):
+            if i == m or felm[i] != felm[start]:
+                cells.append("\\multicolumn{%d}{c}{\\textit{%s}}"
+                             % (i - start, 'felm' if felm[start] else 'OLS'))
+                start = i
+        lines.append("\\\\[-1.8ex] & " + " & ".join(cells) + " \\\\ ")
+    lines.append("\\hline \\\\[-1.8ex] ")
+
+    covariates = []
+    for regressors, _ in models:
+        covariates.extend(r for r in regressors if r not in covariates)
+    if not all(felm):
+        covariates.append('Constant')
+    for covariate in covariates:
+        coefs, ses = [], []
+        for fit, is_felm in zip(fits, felm):
+            # felm absorbs the intercept into the fixed effects
+            if covariate == 'Constant' and is_felm:
+                coefs.append('')
+                ses.append('')
+            elif covariate in fit['names'] and \
+                    not np.isnan(fit['coef'][fit['names'].index(covariate)]):
+                j = fit['names'].index(covariate)
+                coefs.append(format_number(fit['coef'][j])
+                             + stars(fit['pvalue'][j]))
+                ses.append('(' + format_number(fit['se'][j]) + ')')
+            else:
+                coefs.append('')
+                ses.append('')
+        lines.append(" " + COVARIATE_LABELS.get(covariate, covariate)
+                     + " & " + " & ".join(coefs) + " \\\\ ")
+        lines.append("  & " + " & ".join(ses) + " \\\\ ")
+        lines.append("  " + "& " * m + "\\\\ ")
+
+    lines.append("\\hline \\\\[-1.8ex] ")
+    used_fe = []
+    for _, fixed_effects in models:
+        used_fe.extend(fe for fe in fixed_effects if fe not in used_fe)
+    for fe in used_fe:
+        lines.append(FE_LABELS.get(fe, fe) + " & " + " & ".join(
+            'Yes' if fe in fixed_effects else 'No'
+            for _, fixed_effects in models) + " \\\\ ")
+    lines.append("Observations & " + " & ".join(
+        '{:,}'.format(fit['nobs']) for fit in fits) + " \\\\ ")
+    lines.append("R$^{2}$ & " + " & ".join(
+        '%.3f' % fit['r2'] for fit in fits) + " \\\\ ")
+    lines += [
+        "\\hline ",
+        "\\hline \\\\[-1.8ex] ",
+        "\\textit{Note:}  & \\multicolumn{" + str(m) + "}{r}{$^{*}$p$<$0.1; "
+        "$^{**}$p$<$0.05; $^{***}$p$<$0.01} \\\\ ",
+        "\\end{tabular} ",
+        "\\end{table} "]
+    return "\n".join(lines) + "\n"
+
+
+def plot_residuals(data, residuals, filename, result_dir=RESULT_DIR):
+    """
+    Plot the residuals of a model against three state level variables, with
+    a fitted line
+    Inputs:
+        data (dataframe): the rows of the model
+        residuals (array): the residuals of the model
+        filename (string): name of the saved plot
+    """
+    variables = [('state_med_owner_cost', 'Monthly Median Owner Cost'),
+                 ('state_pct_emp_tech', 'Percentage Employed In Tech'),
+                 ('state_pct_college', 'Percentage With College Degree')]
+    fig, axes = plt.subplots(1, 3, figsize=(15, 5))
+    for ax, (variable, label) in zip(axes, variables):
+        x = data[variable].to_numpy(dtype=float)
+        ax.scatter(x, residuals, facecolors='none', edgecolors='black', s=12)
+        slope, intercept = np.polyfit(x, residuals, 1)
+        line = np.linspace(x.min(), x.max(), 100)
+        ax.plot(line, intercept + slope * line, color='#3366FF')
+        ax.set_title('Residuals vs ' + label)
+        ax.set_xlabel(label)
+        ax.set_ylabel('Residuals')
+    fig.tight_layout()
+    fig.savefig(f'{result_dir}/{filename}')
+    plt.close(fig)
+
+
+def plot_residual_distribution(residuals, titles, result_dir=RESULT_DIR):
+    """
+    Plot the density of the residuals of several models side by side
+    """
+    fig, axes = plt.subplots(1, len(residuals), figsize=(15, 5))
+    for ax, resid, title in zip(axes, residuals, titles):
+        grid = np.linspace(resid.min(), resid.max(), 512)
+        ax.plot(grid, stats.gaussian_kde(resid)(grid), color='black',
+                linewidth=1.1)
+        ax.set_title(title)
+        ax.set_xlabel('Residuals')
+        ax.set_ylabel('Density')
+    fig.tight_layout()
+    fig.savefig(f'{result_dir}/residuals_distribution.png')
+    plt.close(fig)
+
+
+def run_regressions(result_dir=RESULT_DIR, plots=True):
+    """
+    Fit the models of every table, save the LaTeX tables and the residual
+    plots
+    Outputs:
+        fits (list): the fits of every table
+    """
+    data = load_data()
+    results = []
+    for table in TABLES:
+        fits = run_table(data, table['models'])
+        with open(f"{result_dir}/{table['file']}", 'w') as f:
+            f.write(stargazer_table(table['models'], fits, table['title']))
+        print("[INFO] Saved {}".format(table['file']))
+        results.append(fits)
+        if plots:
+            last = fits[-1]
+            plot_residuals(data[last['rows']], last['residuals'],
+                           'residuals_check{}.png'.format(len(results)),
+                           result_dir)
+    if plots:
+        plot_residual_distribution(
+            [fits[-1]['residuals'] for fits in results],
+            ['Residuals from Table (1) Col (6)',
+             'Residuals from Table (2) Col (6)',
+             'Residuals from Table (3) Col (2)'], result_dir)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', default=RESULT_DIR,
+                        help='folder of the tables and plots')
+    parser.add_argument('--no-plots', action='store_true',
+                        help='only save the tables')
+    args = parser.parse_args()
+    run_regressions(args.output, not args.no_plots)
@@ -0,0 +1,261 @@
+"""
+This file runs the state clustered inference of the regressions in
+regressions.py. The listings are linked to only 51 states, so the state level
+variables vary across 51 clusters, not across 4,400 listings.
+Two resampling methods are used:
+    - cluster bootstrap: the states are drawn with replacement and the model
+      is refitted on the listings of the drawn states
+    - permutation test: the state level variables are shuffled between the
+      states, which breaks their link with the salaries, and the t statistics
+      of the shuffled fits give the null distribution
+Refitting the model on the listings for every replicate is not needed. The
+Gram matrix X'X and X'y are sums over the states, so they are computed once
+per state, and every replicate only takes weighted sums of these 51 blocks:
+    bootstrap:   X'WX = sum_g c_g * X_g'X_g, with c_g the draws of state g
+    permutation: the state columns of X'X and X'y are rebuilt from the state
+                 values, the listing counts and the column sums of the
+                 listings of each state
+All the replicates are drawn as one matrix (replicates x states) from a seeded
+generator, so the results do not depend on the number of processes, then
+split into batches that are solved in a process pool.
+
+$ python resampling.py --replicates 10000 --processes 4
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+from scipy import stats
+import regressions
+
+
+CLUSTER = 'company_roleLocation'
+OUTPUT_FILE = '../reg_result/resampling.csv'
+
+
+def model_design(data, model):
+    """
+    Build the design matrix of a model on its complete cases
+    Inputs:
+        data (dataframe): the merged data (see regressions.load_data)
+        model (tuple): (regressors, fixed effects) of the model
+    Outputs:
+        X (array): the scaled independent columns of the design matrix
+        y (array): the dependent variable
+        clusters (array): the state code of every row
+        names (list): the names of the columns, None for fixed effect dummies
+        scale (array): the norm of every column of X before scaling
+    """
+    regressors, _ = model
+    rows = data[[regressions.DEPENDENT] + regressors].notna().all(axis=1)
+    subset = data[rows]
+    X, names, _ = regressions.build_design(subset, [model])
+    # the replicates are solved from dense (p x p) blocks of every state, so
+    # the design of a single model (tens of columns) is used dense here
+    Xs, scale, keep = regressions.independent_columns(X.toarray())
+    clusters, _ = pd.factorize(subset[CLUSTER])
+    return (Xs[:, keep], subset[regressions.DEPENDENT].to_numpy(dtype=float),
+            clusters, [names[j] for j in keep], scale[keep])
+
+
+def solve_batch(gram, xty):
+    """
+    Solve a batch of normal equations. Fixed effect levels that are not in
+    a bootstrap sample have an empty column, their coefficient is set to 0.
+    Inputs:
+        gram (array): the X'X matrices, shape (replicates, p, p)
+        xty (array): the X'y vectors, shape (replicates, p)
+    Outputs:
+        inverse (array): the inverses of the X'X matrices
+        beta (array): the coefficients, shape (replicates, p)
+    """
+    p = gram.shape[1]
+    diagonal = np.arange(p)
+    empty = gram[:, diagonal, diagonal] == 0
+    gram = gram.copy()
+    gram[:, diagonal, diagonal] += empty
+    try:
+        inverse = np.linalg.inv(gram)
+    except np.linalg.LinAlgError:
+        inverse = np.linalg.pinv(gram, hermitian=True)
+    return inverse, np.einsum('bij,bj->bi', inverse, xty)
+
+
+def bootstrap_batch(counts, cluster_gram, cluster_xty):
+    """
+    Fit the model on a batch of cluster bootstrap samples
+    Inputs:
+        counts (array): the number of draws of every state, shape
+                        (replicates, states)
+        cluster_gram (array): X_g'X_g of every state, shape (states, p, p)
+        cluster_xty (array): X_g'y_g of every state, shape (states, p)
+    Outputs:
+        beta (array): the coefficients of every sample, shape (replicates, p)
+    """
+    gram = np.einsum('bg,gij->bij', counts, cluster_gram)
+    xty = counts @ cluster_xty
+    return solve_batch(gram, xty)[1]
+
+
+def permutation_batch(permutations, state_values, sizes, z_sums, y_sums,
+                      ztz, zty, yty, n):
+    """
+    Compute the t statistics of the state level variables on a batch of
+    permutations of the states
+    Inputs:
+        permutations (array): the state whose values each state takes,
+                              shape (replicates, states)
+        state_values (array): the state level variables of every state,
+                              shape (states, q)
+        sizes (array): the number of listings of every state
+        z_sums (array): the column sums of the other columns over the
+                        listings of every state, shape (states, p - q)
+        y_sums (array): the sum of y over the listings of every state
+        ztz, zty, yty: Z'Z, Z'y and y'y of the other columns
+        n (int): the number of listings
+    Outputs:
+        t (array): the t statistics of the state level variables, shape
+                   (replicates, q)
+    """
+    values = state_values[permutations]
+    q = state_values.shape[1]
+    b = len(permutations)
+    sts = np.einsum('bgi,g,bgj->bij', values, sizes, values)
+    stz = np.einsum('bgi,gj->bij', values, z_sums)
+    gram = np.concatenate([
+        np.concatenate([sts, stz], axis=2),
+        np.concatenate([stz.transpose(0, 2, 1),
+                        np.broadcast_to(ztz, (b,) + ztz.shape)], axis=2)],
+        axis=1)
+    xty = np.concatenate([values.transpose(0, 2, 1) @ y_sums,
+                          np.broadcast_to(zty, (b, len(zty)))], axis=1)
+    inverse, beta = solve_batch(gram, xty)
+    rss = yty - np.sum(beta * xty, axis=1)
+    sigma2 = rss / (n - gram.shape[1])
+    variance = sigma2[:, None] * np.diagonal(inverse, axis1=1, axis2=2)[:, :q]
+    return beta[:, :q] / np.sqrt(variance)
+
+
+def in_batches(function, replicates, batch_size, processes):
+    """
+    Run function on the batches of rows of the replicate matrix, in a process
+    pool if processes > 1, and stack the results in order
+    """
+    batches = [replicates[start:start + batch_size]
+               for start in range(0, len(replicates), batch_size)]
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return np.concatenate(list(executor.map(function, batches)))
+    return np.concatenate([function(batch) for batch in batches])
+
+
+def resample(data, model, replicates=10000, seed=0, processes=1,
+             batch_size=500, level=0.95):
+    """
+    Run the cluster bootstrap and the permutation test of a model
+    Inputs:
+        data (dataframe): the merged data (see regressions.load_data)
+        model (tuple): (regressors, fixed effects) of the model
+        replicates (int): the number of bootstrap samples and permutations
+        seed (int): the seed of the random generator
+        processes (int): the number of processes solving the batches
+        batch_size (int): the number of replicates solved at once
+        level (float): the level of the bootstrap confidence intervals
+    Outputs:
+        result (dataframe): a row per regressor with coef, se (the usual OLS
+                            standard error), boot_se, ci_low, ci_high,
+                            perm_p (the permutation p-value of the t
+                            statistic, for the state level variables) and
+                            t_p (the usual OLS p-value)
+    """
+    X, y, clusters, names, scale = model_design(data, model)
+    n, p = X.shape
+    G = clusters.max() + 1
+    rng = np.random.default_rng(seed)
+
+    # the OLS fit on all the listings
+    inverse, beta = solve_batch((X.T @ X)[None], (X.T @ y)[None])
+    inverse, beta = inverse[0], beta[0]
+    rss = np.sum((y - X @ beta) ** 2)
+    se = np.sqrt(rss / (n - p) * np.diag(inverse))
+
+    # cluster bootstrap, from the Gram blocks of every state
+    cluster_gram = np.zeros((G, p, p))
+    cluster_xty = np.zeros((G, p))
+    for g in range(G):
+        rows = clusters == g
+        cluster_gram[g] = X[rows].T @ X[rows]
+        cluster_xty[g] = X[rows].T @ y[rows]
+    counts = rng.multinomial(G, np.full(G, 1 / G), size=replicates)
+    boot = in_batches(partial(bootstrap_batch, cluster_gram=cluster_gram,
+                              cluster_xty=cluster_xty),
+                      counts.astype(float), batch_size, processes)
+
+    # permutation test of the state level variables
+    state = [j for j, name in enumerate(names)
+             if name in regressions.STATE_VARIABLES]
+    other = [j for j in range(p) if j not in state]
+    t_obs = beta[state] / se[state]
+    perm_p = np.full(len(state), np.nan)
+    if state:
+        first_row = np.unique(clusters, return_index=True)[1]
+        sizes = np.bincount(clusters, minlength=G).astype(float)
+        z_sums = np.zeros((G, len(other)))
+        np.add.at(z_sums, clusters, X[:, other])
+        y_sums = np.bincount(clusters, weights=y, minlength=G)
+        Z = X[:, other]
+        permutations = rng.permuted(np.tile(np.arange(G), (replicates, 1)),
+                                    axis=1)
+        t_perm = in_batches(partial(
+            permutation_batch, state_values=X[first_row][:, state],
+            sizes=sizes, z_sums=z_sums, y_sums=y_sums, ztz=Z.T @ Z,
+            zty=Z.T @ y, yty=y @ y, n=n),
+            permutations, batch_size, processes)
+        perm_p = (1 + np.sum(np.abs(t_perm) >= np.abs(t_obs), axis=0)) \
+            / (replicates + 1)
+
+    alpha = (1 - level) / 2
+    result = pd.DataFrame({
+        'term': [name if name is not None else 'FE' for name in names],
+        'coef': beta / scale, 'se': se / scale,
+        'boot_se': boot.std(axis=0, ddof=1) / scale,
+        'ci_low': np.quantile(boot, alpha, axis=0) / scale,
+        'ci_high': np.quantile(boot, 1 - alpha, axis=0) / scale,
+        'perm_p': np.nan})
+    result.loc[state, 'perm_p'] = perm_p
+    result['t_p'] = 2 * stats.t.sf(np.abs(result['coef'] / result['se']),
+                                   n - p)
+    return result[result['term'] != 'FE'].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--replicates', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=1,
+                        help='processes solving the batches, 0 for one per '
+                             'CPU')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--output', default=OUTPUT_FILE)
+    args = parser.parse_args()
+
+    data = regressions.load_data()
+    results = []
+    start = time.perf_counter()
+    for number, table in enumerate(regressions.TABLES, start=1):
+        for column, model in enumerate(table['models'], start=1):
+            result = resample(data, model, args.replicates, args.seed,
+                              args.processes or os.cpu_count(),
+                              args.batch_size)
+            result.insert(0, 'table', number)
+            result.insert(1, 'column', column)
+            results.append(result)
+    results = pd.concat(results, ignore_index=True)
+    results.to_csv(args.output, index=False)
+    print("[INFO] {} models with {} replicates in {:.1f} s, saved to {}"
+          .format(len(results.groupby(['table', 'column'])), args.replicates,
+                  time.perf_counter() - start, args.output))
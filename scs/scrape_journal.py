@@ -0,0 +1,129 @@
+"""
+This file keeps the progress journal of the Glassdoor scraper so that an
+interrupted run can be resumed where it stopped.
+The journal is an append-only file of JSON lines next to the output csv file.
+A line is written after every finished result page (state, page_index,
+total_listingCount and the listings written for that page) and after every
+finished state. Every line is flushed to disk before the scraper moves on, and
+parallel workers can share one journal since each line is a single append.
+"""
+
+import csv
+import json
+import os
+import description_scrape
+
+
+class ScrapeJournal:
+    """
+    Durable record of the states, pages and listings already scraped
+    """
+    def __init__(self, path):
+        """
+        Inputs:
+            path (str): path of the journal file
+        """
+        self.path = path
+        self.pages = {}
+        self.done = set()
+        self.written = set()
+        self.load()
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        # start a fresh line after a torn last line
+        if os.path.getsize(path) > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    os.write(self.fd, b"\n")
+
+    def load(self):
+        """
+        Read the progress recorded by earlier runs. A torn last line from a
+        crash in the middle of a write is ignored.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                self.apply(record)
+
+    def apply(self, record):
+        """
+        Update the in-memory progress with a journal record
+        """
+        state = record['state']
+        if record['event'] == 'page':
+            self.pages[state] = (record['page_index'],
+                                 record['total_listingCount'])
+            self.written.update((state, listing_id)
+                                for listing_id in record['listings'])
+        elif record['event'] == 'written':
+            self.written.update((state, listing_id)
+                                for listing_id in record['listings'])
+        elif record['event'] == 'state_done':
+            self.done.add(state)
+
+    def append(self, record):
+        """
+        Write a record to the journal and flush it to disk
+        """
+        os.write(self.fd, (json.dumps(record) + "\n").encode())
+        os.fsync(self.fd)
+        self.apply(record)
+
+    def sync_with_csv(self, output_fileName):
+        """
+        Record the listings that are already in the output csv file but not
+        in the journal. These are rows that reached the csv before the crash
+        but whose page was never recorded.
+        """
+        if not os.path.exists(output_fileName):
+            return
+        missing = {}
+        with open(output_fileName, newline='') as f:
+            for row in csv.reader(f):
+                if len(row) < 14 or row[13] == "search_state":
+                    continue
+                listing_id = description_scrape.extract_listing_id(row[12])
+                if listing_id is not None and \
+                        not self.is_written(row[13], listing_id):
+                    missing.setdefault(row[13], []).append(listing_id)
+        for state, listings in missing.items():
+            self.append({'event': 'written', 'state': state,
+                         'listings': listings})
+
+    def record_page(self, state, page_index, total_listingCount, listings):
+        """
+        Record a finished result page and the listings written for it
+        """
+        self.append({'event': 'page', 'state': state,
+                     'page_index': page_index,
+                     'total_listingCount': total_listingCount,
+                     'listings': [listing_id for listing_id in listings
+                                  if listing_id is not None]})
+
+    def record_state_done(self, state):
+        """
+        Record that every page of the state has been scraped
+        """
+        self.append({'event': 'state_done', 'state': state})
+
+    def progress(self, state):
+        """
+        Return the page_index to continue from and the total_listingCount
+        reached so far for the state
+        """
+        if state in self.pages:
+            page_index, total_listingCount = self.pages[state]
+            return page_index + 1, total_listingCount
+        return 1, 0
+
+    def is_written(self, state, listing_id):
+        return listing_id is not None and (state, listing_id) in self.written
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,114 @@
+"""
+This file contains the fetch/parse pipeline of the Glassdoor scraper.
+Fetching a listing page waits on the network while parsing it with
+BeautifulSoup keeps the CPU busy, so the two are decoupled: a fetcher thread
+pushes the raw html of the listings into a bounded queue, and a process pool
+parses the pages into the listing tuples while the next pages are fetched.
+The queue and a cap on the pages handed to the pool keep the memory bounded
+when the parsing falls behind the fetching.
+"""
+
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import description_scrape
+
+
+class ListingPipeline:
+    """
+    Producer/consumer pipeline that fetches listings and parses them in a
+    process pool
+    """
+    def __init__(self, fetcher, processes=2, queue_size=8, max_in_flight=16,
+                 archive=None, companies=None):
+        """
+        Inputs:
+            fetcher (HttpFetcher): the fetch backend of the listing pages
+            processes (int): number of parsing processes
+            queue_size (int): number of fetched pages waiting to be handed to
+                              the pool before the fetcher blocks
+            max_in_flight (int): number of pages handed to the pool that are
+                                 not parsed yet before the hand-off blocks
+            archive (HtmlArchive): archive of the fetched pages, or None
+            companies (CompanyStore): store of the company fields of known
+                                      employers, or None
+        """
+        self.fetcher = fetcher
+        self.archive = archive
+        self.companies = companies
+        self.queue_size = queue_size
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.pool = ProcessPoolExecutor(max_workers=processes)
+
+    def fetch_all(self, listing_urls, pages):
+        """
+        Producer: fetch the listings one by one into the queue, blocking while
+        the queue is full. None marks the end of the listings.
+        """
+        try:
+            for i, listing_url in enumerate(listing_urls):
+                src, requested_url = self.fetcher.fetch(listing_url)
+                pages.put((i, src, requested_url))
+        except Exception as e:
+            print("[ERROR] In listing fetcher: {}".format(e))
+        finally:
+            pages.put(None)
+
+    def run(self, browser, listing_urls):
+        """
+        Fetch and parse the listings. Listings that could not be fetched, or
+        whose page had no data, are extracted with the browser afterwards.
+
+        Inputs:
+            browser (SeleniumFetcher): the webdriver fetch backend
+            listing_urls (list): the urls of the listings
+        Output:
+            listings (list): the listing tuples, in the order of listing_urls
+        """
+        listing_urls = list(listing_urls)
+        pages = queue.Queue(maxsize=self.queue_size)
+        producer = threading.Thread(target=self.fetch_all,
+                                    args=(listing_urls, pages), daemon=True)
+        producer.start()
+
+        futures = {}
+        # the html of the parsed pages, archived once they turn out to have
+        # the listing data
+        sources = {}
+        while True:
+            page = pages.get()
+            if page is None:
+                break
+            i, src, requested_url = page
+            if src is None:
+                continue
+            if self.archive is not None:
+                sources[i] = src
+            self.in_flight.acquire()
+            future = self.pool.submit(description_scrape.parse_listing_html,
+                                      src, requested_url)
+            future.add_done_callback(lambda f: self.in_flight.release())
+            futures[i] = future
+        producer.join()
+
+        listings = []
+        for i, listing_url in enumerate(listing_urls):
+            rv, has_data = None, False
+            if i in futures:
+                try:
+                    rv, has_data = futures[i].result()
+                except Exception as e:
+                    print("[ERROR] In listing parser: {}".format(e))
+            if rv is not None and self.companies is not None:
+                rv, has_data = self.companies.complete(rv, has_data)
+            if has_data and self.archive is not None:
+                self.archive.put(listing_url, sources.pop(i))
+            if not has_data:
+                rv = description_scrape.extract_listing(
+                    browser, listing_url, archive=self.archive,
+                    companies=self.companies)
+            listings.append(rv)
+        return listings
+
+    def close(self):
+        self.pool.shutdown()
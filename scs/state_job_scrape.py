@@ -3,14 +3,31 @@ This file scrapes the url whem searching for "data science" jobs for a given sta
 It also scrapes the number of possible jobs in that search.
 Finally, if necessary, it provides a function to save the results in a .txt and
 .json file under the "data" folder.
+The search urls follow a regular format built from the state name and the
+Glassdoor location id of the state. url_job_discover builds them from a cached
+table of location ids (data/state_locations.json) and reads the job count from
+the results page over HTTP, for several states at once. The browser is only
+launched for the states that are not in the table yet.
 """
 
 import re
 import json
-from time import sleep
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
+import lxml.html
+import fetch_backend
+import rate_limiter
+
+
+LOCATIONS_FILE = '../data/state_locations.json'
+SEARCH_KEYWORD = 'data-science'
+# e.g. /Job/alaska-data-science-jobs-SRCH_IL.0,6_IS496_KO7,19.htm
+SEARCH_URL_PATTERN = re.compile(r'/Job/(?P<slug>[a-z0-9-]+)-' + SEARCH_KEYWORD
+                                + r'-jobs-SRCH_IL\.0,\d+_IS(?P<location_id>\d+)_')
 
 
 def url_job_scrpae(states_lst):
@@ -33,7 +50,8 @@ def url_job_scrpae(states_lst):
     jobs_count = []
 
     for state in states_lst:
-        driver.get("https://www.glassdoor.com/Job/index.htm")
+        rate_limiter.polite_get(driver, "https://www.glassdoor.com/Job/index.htm",
+                                ready=(By.ID, "KeywordSearch"))
 
         # job, location search and load
         jobs_input = driver.find_element(By.XPATH,
@@ -50,9 +68,11 @@ def url_job_scrpae(states_lst):
         search = driver.find_element(By.XPATH,
                                      '//button[@type="submit"]'
                                     )
+        rate_limiter.limiter.acquire()
         search.click()
-        sleep(5)
         driver.switch_to.window(driver.window_handles[-1])
+        rate_limiter.wait_for(driver,
+                              (By.XPATH, '//h1[@data-test="jobCount-H1title"]'))
 
         # get the url
         url = driver.current_url
@@ -63,13 +83,135 @@ def url_job_scrpae(states_lst):
                                          '//h1[@data-test="jobCount-H1title"]'
                                         ).text
         jobs_count.append(re.findall(r'\d+', total_jobs)[0])
-        sleep(5)
 
     driver.quit()
+    print(rate_limiter.limiter.report())
     job_count_dict = dict(zip(states_lst, jobs_count))
     return state_url, job_count_dict
 
 
+def search_url(slug, location_id, keyword=SEARCH_KEYWORD):
+    """
+    Build the url of a state-level search. The IL and KO parts are the
+    character ranges of the location and of the keyword in the path.
+
+    Inputs:
+        slug (str): the state name in the url, e.g. "new-york"
+        location_id (str): the Glassdoor id of the state, e.g. "428"
+        keyword (str): the searched keyword in the url
+    """
+    start = len(slug) + 1
+    return ("https://www.glassdoor.com/Job/{}-{}-jobs-SRCH_IL.0,{}_IS{}_KO{},{}"
+            ".htm".format(slug, keyword, len(slug), location_id, start,
+                          start + len(keyword)))
+
+
+def parse_search_url(url):
+    """
+    Return the {"slug", "location_id"} entry of a search url, or None if the
+    url is not a state-level search
+    """
+    match = SEARCH_URL_PATTERN.search(url)
+    if match is None:
+        return None
+    return {'slug': match.group('slug'),
+            'location_id': match.group('location_id')}
+
+
+def load_locations(path=LOCATIONS_FILE):
+    """
+    Read the table of "state: {slug, location_id}", empty if there is none
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_locations(locations, path=LOCATIONS_FILE):
+    with open(path, 'w') as f:
+        json.dump(locations, f, indent=1)
+
+
+def extract_job_count(src):
+    """
+    Read the number of jobs from the html of a search results page, None if
+    the page has no job count (e.g. a throttling page)
+    """
+    titles = lxml.html.fromstring(src).xpath(
+        '//h1[@data-test="jobCount-H1title"]')
+    if not titles:
+        return None
+    numbers = re.findall(r'\d+', titles[0].text_content().replace(',', ''))
+    if not numbers:
+        return None
+    return numbers[0]
+
+
+def discover_state(fetcher, location):
+    """
+    Build the search url of a state and request its results page
+
+    Inputs:
+        fetcher (HttpFetcher): the pooled HTTP session
+        location (dict): the {"slug", "location_id"} entry of the state
+    Outputs:
+        url (str): the search url
+        job_count (str): the number of jobs, None if the page had none
+    """
+    url = search_url(location['slug'], location['location_id'])
+    src, _ = fetcher.fetch(url)
+    if src is None:
+        return url, None
+    return url, extract_job_count(src)
+
+
+def url_job_discover(states_lst, locations_path=LOCATIONS_FILE, threads=4):
+    """
+    Same output as url_job_scrpae, without the browser for the states that
+    are in the location table. The states missing from the table, and the
+    states whose results page could not be read, are searched with the
+    browser, and the table is updated with their location ids.
+
+    Inputs:
+        states_lst (list): the list of states in the US
+        locations_path (str): path of the "state: {slug, location_id}" table
+        threads (int): number of results pages requested at once
+    Output:
+        state_url (list): the list of urls of the searches
+        job_count_dict (dict): the dictionary of "state: possible job number"
+    """
+    locations = load_locations(locations_path)
+    known = [state for state in states_lst if state in locations]
+    results = {}
+    fetcher = fetch_backend.HttpFetcher(pool_size=threads)
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for state, result in zip(known, executor.map(
+                    lambda state: discover_state(fetcher, locations[state]),
+                    known)):
+                if result[1] is not None:
+                    results[state] = result
+    finally:
+        fetcher.close()
+
+    browser_states = [state for state in states_lst if state not in results]
+    if browser_states:
+        print("[INFO] Searching {} states with the browser: {}"
+              .format(len(browser_states), ", ".join(browser_states)))
+        urls, counts = url_job_scrpae(browser_states)
+        for state, url in zip(browser_states, urls):
+            results[state] = (url, counts[state])
+            location = parse_search_url(url)
+            if location is not None:
+                locations[state] = location
+        save_locations(locations, locations_path)
+
+    state_url = [results[state][0] for state in states_lst]
+    job_count_dict = {state: results[state][1] for state in states_lst}
+    return state_url, job_count_dict
+
+
 def save_url_job_count(state_url, job_count_dict):
     """
     Save the scrpaed url and job count dictionary into txt and json file
@@ -88,6 +230,14 @@ def save_url_job_count(state_url, job_count_dict):
         json.dump(job_count_dict, outfile)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--browser', action='store_true',
+                        help='search every state with the browser instead of '
+                             'building the urls from the location table')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='results pages requested at once')
+    args = parser.parse_args()
+
     # some states are not in abbreviated form due to having same abbreviation as
     # famous cities. eg) LA = {Los Angeles, Louisiana}, NY = {NewYork City, NewYork State}
     states_lst = ['AK', 'AL', 'AR', 'AZ', 'CA', 'CO', 'CT', 'DC',
@@ -99,6 +249,10 @@ if __name__ == "__main__":
                   'South Dakota, US', 'TN', 'TX', 'UT', 'VA', 'VT', 'WA', 'WI',
                   'WV', 'WY']
 
-    state_url, job_count_dict = url_job_scrpae(states_lst)
+    if args.browser:
+        state_url, job_count_dict = url_job_scrpae(states_lst)
+    else:
+        state_url, job_count_dict = url_job_discover(states_lst,
+                                                     threads=args.threads)
     # save the url and job scraper to file
     save_url_job_count(state_url, job_count_dict)